@@ -0,0 +1,77 @@
+import os
+import sys
+import time
+import socket
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'version-4-refactor'))
+
+from utils.communication_utils import send_json, recv_json, TurnProtocol
+
+TURNS = 20  # Turns per run
+LEGACY_SLEEP = 0.1  # Old TIME_TO_SLEEP before every command
+
+
+# ========================================== LEGACY (SLEEP BASED) ==========================================
+def legacy_command(conn, command):
+    time.sleep(LEGACY_SLEEP)  # Small delay to avoid race conditions
+    send_json(conn, {'name': "system", 'message': command})
+
+def legacy_speaker(conn):
+    legacy_command(conn, "LISTEN")
+    recv_json(conn)  # SPEAK
+    legacy_command(conn, "STOP")
+
+def legacy_listener(conn):
+    recv_json(conn)  # LISTEN
+    legacy_command(conn, "SPEAK")
+    recv_json(conn)  # STOP
+
+
+# ========================================== ACK BASED ==========================================
+def protocol_speaker(conn):
+    conn.send_listen()
+    conn.expect("SPEAK")
+    conn.send_stop()
+
+def protocol_listener(conn):
+    conn.expect("LISTEN")
+    conn.send_speak()
+    conn.expect("STOP")
+
+
+def run(speaker, listener, wrap):
+    """
+    Run TURNS turns alternating the speaker between both ends and return the time of each turn.
+    """
+    a, b = socket.socketpair()
+    a, b = wrap(a), wrap(b)
+
+    def peer():
+        for turn in range(TURNS):
+            (listener if turn % 2 == 0 else speaker)(b)
+
+    thread = threading.Thread(target=peer)
+    thread.start()
+    times = []
+    for turn in range(TURNS):
+        start = time.perf_counter()
+        (speaker if turn % 2 == 0 else listener)(a)
+        times.append(time.perf_counter() - start)
+    thread.join()
+    return times
+
+
+def report(label, times):
+    times = sorted(times)
+    mean = sum(times) / len(times)
+    print(f"{label:<12} media {mean * 1000:8.2f} ms/turno   p50 {times[len(times) // 2] * 1000:8.2f} ms   max {times[-1] * 1000:8.2f} ms")
+
+
+if __name__ == '__main__':
+    print(f"Latencia del protocolo por turno ({TURNS} turnos, sin audio ni LLM)")
+    legacy = run(legacy_speaker, legacy_listener, lambda sock: sock)
+    report("Con sleeps", legacy)
+    acked = run(protocol_speaker, protocol_listener, TurnProtocol)
+    report("Con acks", acked)
+    print(f"Ahorro por turno: {(sum(legacy) - sum(acked)) / TURNS * 1000:.2f} ms")
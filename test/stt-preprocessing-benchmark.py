@@ -0,0 +1,113 @@
+import os
+import re
+import sys
+import glob
+import time
+import wave
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'version-4-refactor'))
+
+from utils.common_utils import speech_to_text, prepare_speech, STT_RATE
+
+# Compares the recognition of recorded turns as captured (44100 Hz, with the silence) and preprocessed
+# (silence trimmed, resampled to STT_RATE): bytes uploaded, recognition latency and word error rate.
+# Fixtures: WAV files (16 bit mono, eg. the "recorded" files of AUDIO_ARCHIVE_DIR), each one with a .txt
+# file next to it with the reference transcript.
+# Usage: python test/stt-preprocessing-benchmark.py fixtures_dir [--offline]
+# --offline only measures the preprocessing (no requests to Google).
+
+
+def load_fixture(path):
+    """
+    Read a WAV fixture and its reference transcript.
+    """
+    with wave.open(path, 'rb') as wf:
+        if wf.getsampwidth() != 2 or wf.getnchannels() != 1:
+            raise ValueError(f"{path}: se necesita audio mono de 16 bits")
+        samples = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16)
+        rate = wf.getframerate()
+    reference_path = os.path.splitext(path)[0] + ".txt"
+    reference = None
+    if os.path.exists(reference_path):
+        with open(reference_path, 'r', encoding='utf-8') as f:
+            reference = f.read()
+    return samples, rate, reference
+
+
+def words(text):
+    return re.findall(r"\w+", text.lower())
+
+
+def word_error_rate(reference, hypothesis):
+    """
+    Word level edit distance divided by the words of the reference.
+    """
+    reference, hypothesis = words(reference), words(hypothesis)
+    distances = list(range(len(hypothesis) + 1))
+    for i, ref_word in enumerate(reference, 1):
+        previous, distances[0] = distances[0], i
+        for j, hyp_word in enumerate(hypothesis, 1):
+            previous, distances[j] = distances[j], min(
+                distances[j] + 1,  # Deletion
+                distances[j - 1] + 1,  # Insertion
+                previous + (ref_word != hyp_word),  # Substitution
+            )
+    return distances[-1] / max(1, len(reference))
+
+
+def recognize(audio, rate):
+    start = time.perf_counter()
+    try:
+        text = speech_to_text(audio, rate) if len(audio) else ""
+    except IndexError:  # No results
+        text = ""
+    return text, time.perf_counter() - start
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Uso: python test/stt-preprocessing-benchmark.py directorio_de_grabaciones [--offline]")
+        sys.exit(1)
+    offline = "--offline" in sys.argv
+    paths = sorted(glob.glob(os.path.join(sys.argv[1], "*.wav")))
+    if not paths:
+        print("No se han encontrado grabaciones (.wav)")
+        sys.exit(1)
+
+    totals = {'raw': [0, 0.0, []], 'preprocessed': [0, 0.0, []]}  # bytes, latency, word error rates
+    preprocessing_time = 0.0
+    for path in paths:
+        samples, rate, reference = load_fixture(path)
+
+        start = time.perf_counter()
+        speech_audio = prepare_speech(samples, rate)
+        preprocessing_time += time.perf_counter() - start
+
+        print(f"{os.path.basename(path)}: {len(samples) / rate:.1f} s -> {len(speech_audio) / STT_RATE:.1f} s, "
+              f"{samples.nbytes} -> {speech_audio.nbytes} bytes")
+        totals['raw'][0] += samples.nbytes
+        totals['preprocessed'][0] += speech_audio.nbytes
+        if offline:
+            continue
+
+        for variant, audio, audio_rate in (('raw', samples, rate), ('preprocessed', speech_audio, STT_RATE)):
+            text, latency = recognize(audio, audio_rate)
+            totals[variant][1] += latency
+            if reference is not None:
+                totals[variant][2].append(word_error_rate(reference, text))
+            print(f"    {variant}: {latency:.2f} s | {text}")
+
+    print(f"\nPreprocesado: {preprocessing_time * 1000 / len(paths):.1f} ms por grabación")
+    for variant, (size, latency, errors) in totals.items():
+        line = f"{variant}: {size} bytes"
+        if not offline:
+            line += f" | latencia media: {latency / len(paths):.2f} s"
+            if errors:
+                line += f" | WER medio: {sum(errors) / len(errors):.1%}"
+        print(line)
+    print(f"Reducción de la subida: {totals['raw'][0] / max(1, totals['preprocessed'][0]):.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from dotenv import load_dotenv
+
+from utils.generation_utils import ResponseGenerator
+from utils.scheduler_utils import shared_scheduler
+from utils.metrics_utils import shared_metrics
+from utils.name_utils import NameService
+from utils.context_utils import ContextWindow
+from utils.debate_utils import START_MESSAGE, build_personality, build_topic, build_first_prompt, choose_start, personality_changes
+
+# Headless text only debates: both speakers run in the same process, with no sockets, interface or audio.
+# Usage: python batch.py cofigs-saves/basic.json cofigs-saves/divertido1.json --repeat 100 --workers 8
+
+CONTEXT_MAX_TOKENS = 2000  # Token budget of the history sent to the model
+CONTEXT_MAX_TURNS = 8  # Recent messages sent to the model (besides the personality and the topic)
+SUMMARY_TURNS = 4  # Older messages are folded into a summary in the background (None to disable)
+PERSONALITY_MODE = "append"  # "append" adds personality changes as new system turns, "replace" overwrites the first one
+HEDGE_AFTER = 3.0  # Seconds without an answer before asking the fallback model too (None to disable)
+FALLBACK_MODEL = "llama-3.1-8b-instant"  # Fast model used when the chosen one stalls
+
+name_service = NameService()  # Pool of speaker names of this worker
+
+
+def init_worker(workers):
+    """
+    Split the rate limits of the API keys between the worker processes (every process has its own scheduler).
+    """
+    shared_scheduler.share = 1 / workers
+
+
+def load_jobs(config_paths, repeat=1):
+    """
+    Expand the configuration files into debate jobs.
+    Attributes:
+    - config_paths: paths of configurations saved from the interface (cofigs-saves/*.json)
+    - repeat: debates to run with every configuration
+    Outputs:
+    - jobs: generator of (job id, configuration)
+    """
+    for path in config_paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        name = os.path.splitext(os.path.basename(path))[0]
+        for i in range(repeat):
+            yield f"{name}-{i:04d}", config
+
+
+def run_debate(job_id, config, output_dir):
+    """
+    Run a full text only debate, writing every message to the transcript as soon as it is generated.
+    Attributes:
+    - job_id: identifier of the debate (name of its transcript)
+    - config: configuration in the format of the interface
+    - output_dir: directory of the transcripts
+    Outputs:
+    - result: summary of the debate
+    """
+    load_dotenv()
+    start = time.monotonic()
+    conversation_length = int(config["CONVERSATION_LENGTH"])
+    convince_time = int(config["CONVINCE_TIME"])
+    convince_time_definitive = int(config["CONVINCE_TIME_DEFINITIVE"])
+
+    speakers = []
+    for i, api_key in enumerate((os.getenv('API_KEY_1'), os.getenv('API_KEY_2') or os.getenv('API_KEY_1'))):
+        generator = ResponseGenerator(
+            config["CONVERSATION_TEMPERATURE"], config["FREQUENCY_PENALTY"], config["PRESENCE_PENALTY"], api_key,
+            context_window=ContextWindow(CONTEXT_MAX_TOKENS, CONTEXT_MAX_TURNS), summary_turns=SUMMARY_TURNS,
+            personality_mode=PERSONALITY_MODE, session=job_id, hedge_after=HEDGE_AFTER, fallback_model=FALLBACK_MODEL,
+        )
+        speakers.append({
+            'generator': generator,
+            'model': config[f"model{i + 1}"],
+            'opinion': config[f"model{i + 1}_opinion"],
+            'messages': None,
+        })
+
+    names = name_service.get_names(speakers[0]['generator'], speakers[0]['model'])
+    for i, speaker in enumerate(speakers):
+        speaker['name'] = names[i]
+        speaker['personality'] = build_personality(speaker['opinion'], config[f"model{i + 1}_personality"], names[i])
+    topic = build_topic(config["topic"])
+    current, winner = choose_start(conversation_length)  # 0 = model 1, 1 = model 2
+
+    path = os.path.join(output_dir, f"{job_id}.jsonl")
+    with open(path, 'w', encoding='utf-8') as transcript:
+        def write(entry):
+            transcript.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            transcript.flush()  # Readable while the debate is still running
+
+        write({'job': job_id, 'topic': config["topic"], 'names': names, 'models': [config["model1"], config["model2"]], 'starting': current, 'winner': winner})
+
+        remaining_messages = conversation_length
+        response = None
+        while remaining_messages > 0:
+            speaker, listener = speakers[current], speakers[1 - current]
+            if response is None:  # First message of the debate
+                speaker['messages'] = [{"role": "system", "content": speaker['personality']},
+                                       {"role": "user", "content": build_first_prompt(topic, START_MESSAGE)}]
+            else:
+                instructions = personality_changes(
+                    winner, remaining_messages, convince_time, convince_time_definitive,
+                    speakers[0]['opinion'], speakers[1]['opinion'],
+                )
+                for other, instruction in zip(speakers, instructions):
+                    if instruction is not None and other['messages'] is not None:
+                        other['generator'].change_personality(other['messages'], instruction)
+                        write({'speaker': other['name'], 'personality': instruction})
+
+            response = speaker['generator'].respond(speaker['model'], speaker['messages'])
+            speaker['messages'].append({"role": "assistant", "content": response})
+            if listener['messages'] is None:  # The listener learns the topic with the first message
+                listener['messages'] = [{"role": "system", "content": listener['personality']},
+                                        {"role": "user", "content": topic + "\n\n------------------------------\n" + response}]
+            else:
+                listener['messages'].append({"role": "user", "content": response})
+
+            remaining_messages -= 1
+            write({'speaker': speaker['name'], 'model': speaker['model'], 'remaining': remaining_messages, 'content': response})
+            current = 1 - current  # Switch the speaker
+
+    return {
+        'job': job_id,
+        'transcript': path,
+        'winner': names[winner],
+        'messages': conversation_length,
+        'elapsed': time.monotonic() - start,
+        'metrics': shared_metrics.summary(session=job_id),
+        'hedges': [speaker['generator'].hedge_stats() for speaker in speakers],
+    }
+
+
+def run_batch(jobs, output_dir="transcripts", workers=4):
+    """
+    Run debate jobs in a pool of processes, with at most workers debates at the same time.
+    The summary of every debate is appended to results.jsonl as soon as it finishes.
+    Attributes:
+    - jobs: iterable of (job id, configuration)
+    - output_dir: directory of the transcripts and the results
+    - workers: number of worker processes
+    Outputs:
+    - results: summaries of the finished debates
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    results = []
+    failed = 0
+    pending = {}
+    jobs = iter(jobs)
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(workers,)) as executor, \
+            open(os.path.join(output_dir, "results.jsonl"), 'a', encoding='utf-8') as results_file:
+        while True:
+            for job_id, config in jobs:  # Only a couple of jobs queued per worker, however long the batch is
+                pending[executor.submit(run_debate, job_id, config, output_dir)] = job_id
+                if len(pending) >= workers * 2:
+                    break
+            if not pending:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                job_id = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    failed += 1
+                    print(f"Error en el debate {job_id}: {e}")
+                    continue
+                results.append(result)
+                results_file.write(json.dumps(result, ensure_ascii=False) + "\n")
+                results_file.flush()
+                print(f"[{len(results)} terminados, {failed} fallidos] {job_id}: {result['messages']} mensajes en {result['elapsed']:.1f} s")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Debates de texto sin interfaz ni audio")
+    parser.add_argument('configs', nargs='+', help="configuraciones guardadas desde la interfaz (cofigs-saves/*.json)")
+    parser.add_argument('--repeat', type=int, default=1, help="debates por configuración")
+    parser.add_argument('--workers', type=int, default=4, help="debates simultáneos (procesos)")
+    parser.add_argument('--output', default="transcripts", help="directorio de las transcripciones")
+    args = parser.parse_args()
+
+    try:
+        results = run_batch(load_jobs(args.configs, args.repeat), args.output, args.workers)
+    except KeyboardInterrupt:
+        print("\nSe ha detenido la ejecución manualmente.")
+        sys.exit(1)
+    print(f"{len(results)} debates guardados en {args.output}")
+
+
+if __name__ == "__main__":
+    main()
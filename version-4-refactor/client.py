@@ -2,73 +2,57 @@ import socket
 import json
 import threading
 
-from utils.common_utils import show_speaking_window
-from utils.communication_utils import recv_all
+from utils.common_utils import show_speaking_window, warm_up_audio, audio_stats, stt_stats, capture_stats, tts_stats, speech_services_stats
+from utils.communication_utils import recv_json, send_text, TurnProtocol, ProtocolError
 from utils.conversation_utils import ConversationManagerClient
+from utils.cache_utils import ResponseCache
+from utils.context_utils import ContextWindow
+from utils.metrics_utils import shared_metrics
 
 
-def check_message(messages, client_socket):
+def check_message(messages, conn, cm):
         """
         Check if the message is a system message
         """
-        data = recv_all(client_socket).decode('utf-8')
-        try:
-            server_msg = json.loads(data)
-        except json.JSONDecodeError:
-            # Split the message in two parts because the server sends two messages at once 
-            # (END or END-IN-ONE and CHANGE PERSONALITY)    
-            split = data.split("}",1)
-            server_msg = json.loads(split[0] + "}")
-
-            # NOTE: CHECK PERSONALITY CHANGE, END OR END IN ONE
-            if server_msg['message'] == "END": # If we recieve an END, end the conversation
-                return (True, None)
-
-            server_msg = json.loads(split[1])
-            if server_msg['name'] == "personality":
-                personality = server_msg['message']
-                messages[0] = {"role": "system", "content":personality}
-                
-                data = recv_all(client_socket).decode('utf-8')  # Receive the LISTEN command
-                server_msg = json.loads(data)
+        server_msg = conn.recv()
 
         # NOTE: CHECK PERSONALITY CHANGE, END OR END IN ONE
+        while server_msg['name'] == "personality":  # Personality changes arrive before the next command
+            instruction = server_msg['message']
+            cm.change_personality(messages, instruction)
+
+            server_msg = conn.recv()  # Receive the next command
+
         if server_msg['message'] == "END": # If we recieve an END, end the conversation
             return (True, None)
 
-        if server_msg['name'] == "personality":
-            personality = server_msg['message']
-            messages[0] = {"role": "system", "content":personality}
-            
-            data = recv_all(client_socket).decode('utf-8')  # Receive the LISTEN command
-            server_msg = json.loads(data)
-
         return (False, server_msg)
 
 def main():
     HOST = 'localhost'  # Localhost to use in same pc. FOR ONLINE USE, DO NOT CONNECT TO EDUROAM WIFI! 
     PORT = 4670
 
+    cm = None  # Created once the configuration is received
     try:
         # ============ CONNECTION PHASE ============
         client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)  # Create a socket object
         client_socket.connect((HOST, PORT))  # Connect to the server
         print(f"Conectado al servidor en {HOST}:{PORT}")
        
-        client_socket.sendall("Iniciame".encode('utf-8'))  # Send a request to be initialized
+        send_text(client_socket, "Iniciame")  # Send a request to be initialized
         print("Mensaje enviado: Iniciame")
 
         # ============ CONFIGURATION PHASE ============
-        data = recv_all(client_socket)  # Receive the config from the server
-        
-        data_js = json.loads(data.decode('utf-8'))  # Parse the configuration
+        data_js = recv_json(client_socket)  # Receive the config from the server
         config = data_js['configuration']
         mess = data_js['message']
         
         print("\n📡 Configuración inicial recibida del servidor:")
         print(json.dumps(mess, indent=4))  # Print the message contained in the configuration
         
-        client_socket.sendall("Estoy listo".encode('utf-8'))  # Send a message to the server informing that we are ready
+        warm_up_audio()  # Open the audio devices before the conversation starts
+
+        send_text(client_socket, "Estoy listo")  # Send a message to the server informing that we are ready
         print("\nMensaje enviado: Estoy listo")
         
         # Set the configuration variables
@@ -79,8 +63,11 @@ def main():
         starting_model = config['starting_model']  # Starting model
         start_message = config['start_message']  # Start message
 
+        protocol = TurnProtocol(client_socket)  # From now on every message follows the turn protocol
+
         # load the manager with the configuration
-        cm = ConversationManagerClient(config['conversation_temperature'], config['frequency_penalty'], config['presence_penalty'])  # Create a ConversationManager object
+        context_window = ContextWindow(config['context_max_tokens'], config['context_max_turns']) if 'context_max_tokens' in config else None
+        cm = ConversationManagerClient(config['conversation_temperature'], config['frequency_penalty'], config['presence_penalty'], stream=config.get('stream', False), text_channel=config.get('text_channel', False), pipeline=config.get('pipeline', False), cache=ResponseCache() if config.get('cache', False) else None, context_window=context_window, summary_turns=config.get('summary_turns'), personality_mode=config.get('personality_mode', "replace"), hedge_after=config.get('hedge_after'), fallback_model=config.get('fallback_model', "llama-3.1-8b-instant"))  # Create a ConversationManager object
         
         # Start the speaking window thread
         window_thread = threading.Thread(target=show_speaking_window, args=("Client",name,), daemon=True)
@@ -88,7 +75,7 @@ def main():
         
         # ============ GREETING PHASE ============
         if starting_model == 0:  # 0 = Server starts, 1 = Client starts
-            message = cm.conversation_listen(conn=client_socket)  # Listen to the server
+            message = cm.conversation_listen(conn=protocol)  # Listen to the server
             
             messages = [{"role": "system", "content":personality},
                         {"role": "user", "content": topic + "\n\n------------------------------\n"+ message["content"]}]
@@ -96,29 +83,29 @@ def main():
         else: # We start (Send a greeting to server)
 
             # start the conversation
-            messages = cm.start_conversation(personality, model, topic, start_message, client_socket)
+            messages = cm.start_conversation(personality, model, topic, start_message, protocol)
     
             # Listen the server
-            message = cm.conversation_listen(client_socket)
+            message = cm.conversation_listen(protocol, model, messages)
             messages.append(message)
 
         # ============ CONVERSATION PHASE ============
         while True:
             # Speak
-            response = cm.conversation_generate_response(client_socket,model,messages)
+            response = cm.conversation_generate_response(protocol,model,messages)
 
-            end, msg = check_message(messages, client_socket)
+            end, msg = check_message(messages, protocol, cm)
             if end:
                 break
             
-            cm.conversation_speak_text(client_socket,response,msg)
+            cm.conversation_speak_text(protocol,response,msg)
             
             # Listen the server
-            end, msg = check_message(messages, client_socket)
+            end, msg = check_message(messages, protocol, cm)
             if end:
                 break
 
-            message = cm.conversation_listen_data(client_socket, msg)
+            message = cm.conversation_listen_data(protocol, msg, model, messages)  # In pipeline mode our answer starts generating while the server speaks
             messages.append(message)
             
     except ConnectionRefusedError:  # Handle connection error
@@ -127,11 +114,21 @@ def main():
         print("\nSe ha cerrado el cliente manualmente.")
     except  json.JSONDecodeError:  # Handle JSON decoding error
         print("\nSe ha producido un error en la comunicación con el servidor")
+    except ProtocolError as e:  # Handle messages out of turn
+        print("\nEl servidor no ha respetado el protocolo de turnos:", e)
     except Exception as e:  # Handle any other exception
         print("\nSe ha producido un error inesperado:", e)
     finally:
         client_socket.close()
         print("Conexión cerrada correctamente.")
+        print("Latencia por modelo:", shared_metrics.summary())
+        if cm is not None:
+            print("Tiempo de procesado del prompt:", cm.prompt_time_stats())
+        print("Dispositivos de audio:", audio_stats())
+        print("Retardo del reconocimiento de voz tras STOP:", stt_stats())
+        print("Nivel de captura del micrófono:", capture_stats())
+        print("Caché de voz:", tts_stats())
+        print("Servicios de voz de Google:", speech_services_stats())
 
 if __name__ == "__main__":
     main()
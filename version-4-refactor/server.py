@@ -1,14 +1,19 @@
 import sys
 import socket
 import json
-import time
-import random
+import asyncio
 import threading
 
 from interface.interface import DebateConfigInterface
-from utils.common_utils import show_speaking_window
-from utils.communication_utils import recv_all
+from utils.common_utils import show_speaking_window, warm_up_audio, audio_stats, stt_stats, capture_stats, tts_stats, speech_services_stats
+from utils.communication_utils import recv_all, send_json, TurnProtocol, ProtocolError
 from utils.conversation_utils import ConversationManager
+from utils.cache_utils import ResponseCache
+from utils.scheduler_utils import shared_scheduler
+from utils.name_utils import NameService
+from utils.context_utils import ContextWindow
+from utils.metrics_utils import shared_metrics
+from utils.debate_utils import START_MESSAGE, build_personality, build_topic, choose_start, personality_changes
 
 # NOTE: NOW IN INTERFACE
 # CONVERSATION_LENGTH # Number of messages the conversation will last
@@ -18,6 +23,26 @@ from utils.conversation_utils import ConversationManager
 # FREQUENCY_PENALTY  # Avoid repeating the same words (0 - 2)
 # PRESENCE_PENALTY # Avoid repeating the same arguments (0 - 2)
 
+MAX_DEBATES = 32  # Debates served at the same time (only one uses the audio devices, the rest run headless)
+STREAM_RESPONSES = True  # Speak the responses sentence by sentence while they are generated
+TEXT_CHANNEL = True  # Send the spoken text with the STOP message so the listener does not transcribe the audio
+PIPELINE_TURNS = True  # Generate the next answer while the other model is still speaking
+CACHE_RESPONSES = False  # Reuse the responses of identical requests (replays of the same saved configuration)
+CONTEXT_MAX_TOKENS = 2000  # Token budget of the history sent to the model
+CONTEXT_MAX_TURNS = 8  # Recent messages sent to the model (besides the personality and the topic)
+SUMMARY_TURNS = 4  # Older messages are folded into a summary in the background (None to disable)
+PERSONALITY_MODE = "append"  # "append" adds personality changes as new system turns, "replace" overwrites the first one
+HEDGE_AFTER = 3.0  # Seconds without an answer before asking the fallback model too (None to disable)
+FALLBACK_MODEL = "llama-3.1-8b-instant"  # Fast model used when the chosen one stalls
+METRICS_LOG = "llm-calls.jsonl"  # Structured log with the latency and tokens of every LLM call (None to disable)
+
+response_cache = None  # ResponseCache shared by every debate, created in main if CACHE_RESPONSES
+name_service = NameService()  # Pool of speaker names shared by every debate
+
+# Speaking window shared by every debate of this host
+window_lock = threading.Lock()
+window_started = False
+
 def init_server():
     """
     Initialize the server socket.
@@ -26,44 +51,43 @@ def init_server():
     PORT = 4670  # Port to listen on
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)  # Create a socket object
     server_socket.bind((HOST, PORT))  # Bind to the port
-    server_socket.listen(1)  # Wait for a connection
+    server_socket.listen(MAX_DEBATES)  # Queue of pending connections
     print(f"Servidor escuchando en {HOST}:{PORT}...")
     return server_socket
 
-def check_personality_change(winner, messages_left, conn, model1_personality, model2_personality, model1_opinion, model2_opinion):
+def check_personality_change(winner, messages_left, conn, model1_opinion, model2_opinion):
     """
     Check if a personality change is needed.
     Attributes:
     - winner: winner of the debate
     - messages_left: remaining messages
     - conn: connection object
-    - model1_personality: original personality of the server
-    - model2_personality: original personality of the client
     - model1_opinion: original opinion of the server
     - model2_opinion: original opinion of the client
     Outputs:
-    - model1_new_personality: new personality for the server if it was changed, None otherwise
+    - model1_instruction: persuasion instruction for the server if it has to change, None otherwise
     """
-    model1_new_personality = None  # New personality for the server
-    model2_new_personality = None  # New personality for the client
-    if messages_left == CONVINCE_TIME and CONVINCE_TIME != 0:  # Halfway through convincing
-        if winner == 0:  # Server wins, convince the client (halfway)
-            model2_new_personality = f"Tu punto de vista original era: {model2_personality}. Sin embargo, los argumentos presentados han comenzado a persuadirte, y estás empezando a cambiar tu perspectiva hacia esta visión: {model1_opinion}. Muestra señales sutiles de estar convencido y ajusta gradualmente tu postura. Reconoce la fuerza de los argumentos del otro interlocutor, pero mantén algunas reservas. Mantén tus explicaciones breves y directas al grano. Comunica claramente tu cambio de postura y explica brevemente por qué has comenzado a cambiar de opinión."
-        else:  # Client wins, convince the server (halfway)
-            model1_new_personality = f"Tu punto de vista original era: {model1_personality}. Sin embargo, los argumentos presentados han comenzado a persuadirte, y estás empezando a cambiar tu perspectiva hacia esta visión: {model2_opinion}. Muestra señales sutiles de estar convencido y ajusta gradualmente tu postura. Reconoce la fuerza de los argumentos del otro interlocutor, pero mantén algunas reservas. Mantén tus explicaciones breves y directas al grano. Comunica claramente tu cambio de postura y explica brevemente por qué has comenzado a cambiar de opinión."
-    elif messages_left == CONVINCE_TIME_DEFINITIVE:  # Fully convinced
-        if winner == 0:  # Server wins, convince the client (fully)
-            model2_new_personality = f"Tu punto de vista original era: {model2_personality}. Sin embargo, después de escuchar los argumentos presentados, ahora estás completamente convencido de este punto de vista: {model1_opinion}. Informa al otro interlocutor que has cambiado de opinión, expresa claramente tu acuerdo con su perspectiva y explica brevemente por qué sus argumentos te convencieron. Mantén tu explicación concisa y directa al grano. Comunica claramente tu cambio de postura y explica brevemente por qué has cambiado de opinión."
-        else:  # Client wins, convince the server (fully)
-            model1_new_personality = f"Tu punto de vista original era: {model1_personality}. Sin embargo, después de escuchar los argumentos presentados, ahora estás completamente convencido de este punto de vista: {model2_opinion}. Informa al otro interlocutor que has cambiado de opinión, expresa claramente tu acuerdo con su perspectiva y explica brevemente por qué sus argumentos te convencieron. Mantén tu explicación concisa y directa al grano. Comunica claramente tu cambio de postura y explica brevemente por qué has cambiado de opinión."
-
-    if model2_new_personality is not None:
-        time.sleep(0.1) # Small delay to avoid race conditions
-        conn.sendall(json.dumps({  # Send the new personality to the client
+    model1_instruction, model2_instruction = personality_changes(winner, messages_left, CONVINCE_TIME, CONVINCE_TIME_DEFINITIVE, model1_opinion, model2_opinion)
+    if model2_instruction is not None:
+        conn.send({  # Send the persuasion instruction to the client
             'name': "personality",  # Client reconizes personality messages as petitions to change personality
-            'message': model2_new_personality
-        }).encode('utf-8'))
-    return model1_new_personality
+            'message': model2_instruction
+        })
+    return model1_instruction
+
+
+def answer_follows(winner, remaining_messages, model1_opinion, model2_opinion):
+    """
+    Check if an answer generated while the client speaks would be used: after the client's turn we
+    have to speak again, without a personality change in between (it changes the history).
+    Attributes:
+    - winner: winner of the debate
+    - remaining_messages: remaining messages, counting the client's turn
+    - model1_opinion, model2_opinion: original opinions
+    """
+    if remaining_messages <= 1:  # The debate ends after the client's turn
+        return False
+    return personality_changes(winner, remaining_messages - 1, CONVINCE_TIME, CONVINCE_TIME_DEFINITIVE, model1_opinion, model2_opinion)[0] is None
 
 
 def check_message_count(remaining_messages, conn):
@@ -71,64 +95,29 @@ def check_message_count(remaining_messages, conn):
     Check the remaining messages and send a signal to the client if needed.
     """
     if remaining_messages <= 0:  # If we are out of messages, break the loop
-        time.sleep(0.1)
-        conn.sendall(json.dumps({
+        conn.send({
             'name': "system",
             'message': "END"
-        }).encode('utf-8'))
+        })
         return True
     
     return False       
 
-def generate_name(model, cm, blacklisted=None):
+def run_debate(conn, addr, config, audio=True):
     """
-    Generate a name for an LLM model.
+    Run a full debate with a connected client. Blocking, every debate runs in its own worker thread
+    with its own ConversationManager, message history and turn counters.
+    The host has a single microphone, speaker and speaking window, so only one debate at a time uses them:
+    the others are headless, they use the text channel and nothing is played, recorded or shown.
     Attributes:
-    - client: Groq client
-    - model: model that will generate the name
-    - blacklisted: name to avoid (if specified)
-    Outputs:
-    - name: generated name
+    - conn: socket connected to the client
+    - addr: address of the client
+    - config: configuration obtained from the interface
+    - audio: if this debate owns the audio devices and the speaking window
     """
-    if blacklisted is None:
-        prompt = 'Date un nombre de persona en español de UNA SOLA PALABRA. No simules una respuesta, solo necesito un nombre. El nombre no puede ser un número ni un digito.'
-    else:
-        prompt = f'Date un nombre de persona en español de UNA SOLA PALABRA que no sea {blacklisted}. No simules una respuesta, solo necesito un nombre. El nombre no puede ser un número ni un digito.'
-    
-    message = [{"role": "user", "content": prompt}]
-    name = cm.generate_response(model,message)
-    name = name.replace('\n', '')
-    name = ''.join(e for e in name if e.isalnum())
-    return name
-
-def main():
-    # Initialize interface and get configuration
-    try: 
-        config_interface = DebateConfigInterface()
-        config = config_interface.get_config()
-
-        # Check if the user closed the window
-        if config_interface.closed_by_user_action:
-            print("La ventana de configuración ha sido cerrada.")
-            sys.exit(0)            
-  
-    except Exception as e:
-        print(f"Error al obtener la configuración: {e}")
-        sys.exit(1)
-
-    # Update global variables with configuration
-    global CONVERSATION_LENGTH, CONVERSATION_TEMPERATURE, CONVINCE_TIME
-    global CONVINCE_TIME_DEFINITIVE, FREQUENCY_PENALTY, PRESENCE_PENALTY
-
-    CONVERSATION_LENGTH = int(config["CONVERSATION_LENGTH"])
-    CONVERSATION_TEMPERATURE = config["CONVERSATION_TEMPERATURE"]
-    CONVINCE_TIME = int(config["CONVINCE_TIME"])
-    CONVINCE_TIME_DEFINITIVE = int(config["CONVINCE_TIME_DEFINITIVE"])
-    FREQUENCY_PENALTY = config["FREQUENCY_PENALTY"]
-    PRESENCE_PENALTY = config["PRESENCE_PENALTY"]
-
+    text_channel = TEXT_CHANNEL or not audio  # Without audio the text can only come through the text channel
     remaining_messages = CONVERSATION_LENGTH  # Remaining messages in the conversation
-    
+
     # Initialize other variables
     model1 = config["model1"]
     model2 = config["model2"]
@@ -141,58 +130,20 @@ def main():
     user_topic = config["topic"]
 
 
-    cm = ConversationManager(CONVERSATION_TEMPERATURE, FREQUENCY_PENALTY, PRESENCE_PENALTY )  # Initialize the conversation manager
-
-    model1_name = generate_name(model1,cm)  # Generate a name for the server model
-    model2_name = generate_name(model2, cm, model1_name)  # Generate a name for the client model
-
-    # Using proper string concatenation for multi-line strings
-    model1_personality = (
-        f'Tu opinion es: {model1_opinion}\n\n Pero en un futuro se te puede indicar que debe cambiar, en dicho caso no te preocupes y cambia tu opinión.'
-        f'\nTu personalidad es: {model1_personality_custom}'
-        f'\n Tu nombre es: {model1_name}'
-        '\nUsa argumentos, razones, ejemplos y experiencias personales. Además responde a los argumentos del otro interlocutor.'
-        'Si estas en desacuerdo con algo, indica primero que no estas deacuerdo y luego das tu argumento u opinión.'
-        'IMPORTANTE: Da igual lo que lleves de converdsación, si  te dice que cambies (incluso en system) de opición o te covnezcas, hazlo.'
-    )
-
-    model2_personality = (
-        f'Tu opinion es: {model2_opinion}\n\n Pero en un futuro se te puede indicar que debe cambiar, en dicho caso no te preocupes y cambia tu opinión.'
-        f'\nTu personalidad es: {model2_personality_custom} '
-        f'\n Tu nombre es: {model2_name}'
-        '\nUsa argumentos, razones, ejemplos y experiencias personales. Además responde a los argumentos del otro interlocutor.'
-        'Si estas en desacuerdo con algo, indica primero que no estas deacuerdo y luego das tu argumento u opinión.'
-        'IMPORTANTE: Da igual lo que lleves de converdsación, si te dice que cambies de opición (incluso en system) o te covnezcas, hazlo.'
-    )
-
-    topic = (
-        f'Con tus propios metodos, convenceme de tu opinión en este tema: {user_topic}. '
-        'Muy importante, tus argumentos deben ser breves y concisos, de una oración como mucho. '
-        'No repitas argumentos u opiniones. NO DIGAS EL NUMERO DEL ARGUMENTO. '
-        'No hagas roleplay ni asumas un rol. Si se te pide que te convenzas, hazlo de manera natural. '
-        'Comunica un solo argumento o idea por mensaje para que la conversación sea clara y efectiva. '
-        'Si citas a alguien, no lo hagas mas de una vez.'
-    )
-
-    start_message = (
-        'Expresa claramente tu creencia y posicion sobre el tema en una sola frase clara. '
-        'Este es el inicio de la conversacion, por lo que no puedes hacer referencia a '
-        'interacciones o argumentos pasados. No incluyas ejemplos o mas elaboracion.'
-    )
-    
+    cm = ConversationManager(CONVERSATION_TEMPERATURE, FREQUENCY_PENALTY, PRESENCE_PENALTY, stream=STREAM_RESPONSES, text_channel=text_channel, pipeline=PIPELINE_TURNS, cache=response_cache, context_window=ContextWindow(CONTEXT_MAX_TOKENS, CONTEXT_MAX_TURNS), summary_turns=SUMMARY_TURNS, personality_mode=PERSONALITY_MODE, session=f"{addr[0]}:{addr[1]}", hedge_after=HEDGE_AFTER, fallback_model=FALLBACK_MODEL, audio=audio)  # Initialize the conversation manager
 
+    model1_name, model2_name = name_service.get_names(cm, model1)  # Names for the server and client models (from the local pool if possible)
 
-    starting_model = random.choice([0, 1]) # 0 = Server starts, 1 = Client starts
-    #winner (0 = Server, 1 = Client)
-    winner = 0  if (starting_model == 0 and CONVERSATION_LENGTH % 2 == 0) or (starting_model == 1 and CONVERSATION_LENGTH % 2 != 0)  else 1 
-    
-    # ============ CONNECTION PHASE ============
-    server_socket = init_server()
-    conn, addr = server_socket.accept()
+    model1_personality = build_personality(model1_opinion, model1_personality_custom, model1_name)
+    model2_personality = build_personality(model2_opinion, model2_personality_custom, model2_name)
+    topic = build_topic(user_topic)
+    start_message = START_MESSAGE
 
+    starting_model, winner = choose_start(CONVERSATION_LENGTH)  # 0 = Server starts / wins, 1 = Client starts / wins
+    
     # ============ CONFIGURATION PHASE ============
     try:
-        print(f"Conexión establecida con {addr}") 
+        print(f"Conexión establecida con {addr}" + ("" if audio else " (sin audio, hay otro debate usando el audio)"))
         data = recv_all(conn).decode('utf-8')  # Receive petition to be initialized
         
         if data== "Iniciame":  # Check the petition
@@ -207,21 +158,39 @@ def main():
                     "conversation_temperature": CONVERSATION_TEMPERATURE,
                     "frequency_penalty": FREQUENCY_PENALTY,
                     "presence_penalty": PRESENCE_PENALTY,
-                    "start_message": start_message
+                    "start_message": start_message,
+                    "stream": STREAM_RESPONSES,
+                    "text_channel": text_channel,
+                    "pipeline": PIPELINE_TURNS,
+                    "cache": CACHE_RESPONSES,
+                    "context_max_tokens": CONTEXT_MAX_TOKENS,
+                    "context_max_turns": CONTEXT_MAX_TURNS,
+                    "summary_turns": SUMMARY_TURNS,
+                    "personality_mode": PERSONALITY_MODE,
+                    "hedge_after": HEDGE_AFTER,
+                    "fallback_model": FALLBACK_MODEL
                 }
             }
-            
-            json_datos = json.dumps(datos_iniciales)  # Pack into a json object
-            conn.sendall(json_datos.encode('utf-8'))  # Send the config to the client
+
+            send_json(conn, datos_iniciales)  # Send the config to the client
+
+        if audio:
+            warm_up_audio()  # Open the audio devices while the client sets itself up
 
         data = recv_all(conn).decode('utf-8')  # Receive the confirmation message from the client that config was received
         if data != "Estoy listo":  # Check the confirmation
             print(f"Error: No se reconoce el comando. Datos recibidos: {data}")
-            sys.exit()
+            return
         
-        # Start the speaking window thread
-        window_thread = threading.Thread(target=show_speaking_window, args=("Server",model1_name,), daemon=True)
-        window_thread.start()
+        protocol = TurnProtocol(conn)  # From now on every message follows the turn protocol
+
+        # Start the speaking window thread (only one window per host, shared by every debate)
+        with window_lock:
+            global window_started
+            if audio and not window_started:
+                window_thread = threading.Thread(target=show_speaking_window, args=("Server",model1_name,), daemon=True)
+                window_thread.start()
+                window_started = True
 
         # ============ GREETING PHASE ============
         print('Tema: ', topic)
@@ -229,13 +198,13 @@ def main():
         
         if starting_model == 0: # We start (Send a greeting to client)
 
-            messages = cm.start_conversation(model_personality=model1_personality, model=model1, topic=topic, start_message=start_message, conn=conn)
+            messages = cm.start_conversation(model_personality=model1_personality, model=model1, topic=topic, start_message=start_message, conn=protocol)
             remaining_messages -= 1  # Decrease the remaining messages
     
         else:
 
             # Listen client and Initiate message history
-            message = cm.conversation_listen(conn)
+            message = cm.conversation_listen(protocol)
             remaining_messages -= 1
 
             messages = [{"role": "system", "content":model1_personality},
@@ -243,50 +212,151 @@ def main():
 
 
             # Speak to client
-            cm.conversation_speak(conn, model1, messages)
+            cm.conversation_speak(protocol, model1, messages, last=remaining_messages <= 1)
             remaining_messages -= 1
 
         # ============ CONVERSATION PHASE ============
         while True:  # Loop to keep the conversation going
-            # Listen client
-            message = cm.conversation_listen(conn)
+            # Listen client (in pipeline mode our answer starts generating while the client speaks)
+            prefetch = answer_follows(winner, remaining_messages, model1_opinion, model2_opinion)
+            message = cm.conversation_listen(protocol, model1 if prefetch else None, messages)
             messages.append(message)  # Append the message to the message history
             remaining_messages -= 1
 
             # Message count checks
-            if check_message_count(remaining_messages, conn):
+            if check_message_count(remaining_messages, protocol):
                 break
 
-            new_personality = check_personality_change(winner, remaining_messages, conn, model1_personality, model2_personality, model1_opinion, model2_opinion)
-            if new_personality is not None:  # If we need to change the personality, do so
-                model1_personality = new_personality
-                messages[0] = {"role": "system", "content":model1_personality}
+            instruction = check_personality_change(winner, remaining_messages, protocol, model1_opinion, model2_opinion)
+            if instruction is not None:  # If we need to change the personality, do so
+                cm.change_personality(messages, instruction)
             
             # Speak to client
-            cm.conversation_speak(conn, model1, messages)
+            cm.conversation_speak(protocol, model1, messages, last=remaining_messages <= 1)
 
             # Message count checks
             remaining_messages -= 1
             
-            if check_message_count(remaining_messages, conn):
+            if check_message_count(remaining_messages, protocol):
                 break
 
-            new_personality = check_personality_change(winner, remaining_messages, conn, model1_personality, model2_personality, model1_opinion, model2_opinion)
-            if new_personality is not None:  # If we need to change the personality, do so
-                model1_personality = new_personality
-                messages[0] = {"role": "system", "content":model1_personality}
+            instruction = check_personality_change(winner, remaining_messages, protocol, model1_opinion, model2_opinion)
+            if instruction is not None:  # If we need to change the personality, do so
+                cm.change_personality(messages, instruction)
             
 
-    except KeyboardInterrupt:  # Handle the keyboard interruption
-        print("\nSe ha cerrado el servidor manualmente.")
     except  json.JSONDecodeError:  # Handle JSON decoding error
         print("\nSe ha producido un error en la comunicación con el cliente")
+    except ProtocolError as e:  # Handle messages out of turn
+        print("\nEl cliente no ha respetado el protocolo de turnos:", e)
     except Exception as e:  # Handle any other exception
         print("\nSe ha producido un error inesperado:", e)
     finally:  # Close the connection
         conn.close()
+        print(f"Conexión con {addr} cerrada correctamente.")
+        if response_cache is not None:
+            print("Caché de respuestas:", response_cache.stats())
+        print("Planificador de peticiones:", shared_scheduler.stats())
+        print("Tiempo de procesado del prompt:", cm.prompt_time_stats())
+        print("Peticiones con respaldo:", cm.hedge_stats())
+        print("Dispositivos de audio:", audio_stats())
+        print("Retardo del reconocimiento de voz tras STOP:", stt_stats())
+        print("Nivel de captura del micrófono:", capture_stats())
+        print("Caché de voz:", tts_stats())
+        print("Servicios de voz de Google:", speech_services_stats())
+        print("Latencia por modelo en este debate:", shared_metrics.summary(session=cm.session))
+
+
+def start_debate(loop, conn, addr, config, audio):
+    """
+    Run a debate in a daemon thread, so a debate in progress never keeps the server alive once it is closed.
+    Outputs:
+    - debate: future of the event loop, done when the debate ends
+    """
+    debate = loop.create_future()
+
+    def _run():
+        try:
+            run_debate(conn, addr, config, audio)
+        finally:
+            try:
+                loop.call_soon_threadsafe(debate.set_result, None)
+            except RuntimeError:  # The event loop was closed while the debate was running
+                pass
+
+    threading.Thread(target=_run, name=f"debate-{addr[0]}:{addr[1]}", daemon=True).start()
+    return debate
+
+async def serve(config):
+    """
+    Accept clients forever, running a concurrent debate for each one of them.
+    Attributes:
+    - config: configuration obtained from the interface
+    """
+    server_socket = init_server()
+    server_socket.setblocking(False)  # Accepted through the event loop
+    loop = asyncio.get_running_loop()
+    debates = {}  # Debate in progress -> its socket
+    audio_debate = None  # Debate that owns the audio devices and the speaking window
+
+    try:
+        while True:
+            if len(debates) >= MAX_DEBATES:  # Full, the next clients wait in the listen queue
+                await asyncio.wait(list(debates), return_when=asyncio.FIRST_COMPLETED)
+            conn, addr = await loop.sock_accept(server_socket)
+            conn.setblocking(True)  # The debate itself uses blocking sockets
+            audio = audio_debate is None or audio_debate.done()
+            debate = start_debate(loop, conn, addr, config, audio)
+            if audio:
+                audio_debate = debate
+            debates[debate] = conn
+            debate.add_done_callback(lambda debate: debates.pop(debate, None))
+            debate.add_done_callback(lambda _, conn=conn: conn.close())  # Also if the debate failed before the handshake
+            print(f"Debates en curso: {len(debates)}")
+    finally:
         server_socket.close()
-        print("Conexión cerrada correctamente.")
+        for conn in list(debates.values()):  # Wake up the debates blocked on their sockets so they end
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+def main():
+    # Initialize interface and get configuration
+    try: 
+        config_interface = DebateConfigInterface()
+        config = config_interface.get_config()
+
+        # Check if the user closed the window
+        if config_interface.closed_by_user_action:
+            print("La ventana de configuración ha sido cerrada.")
+            sys.exit(0)            
+  
+    except Exception as e:
+        print(f"Error al obtener la configuración: {e}")
+        sys.exit(1)
+
+    # Update global variables with configuration
+    global CONVERSATION_LENGTH, CONVERSATION_TEMPERATURE, CONVINCE_TIME
+    global CONVINCE_TIME_DEFINITIVE, FREQUENCY_PENALTY, PRESENCE_PENALTY
+
+    CONVERSATION_LENGTH = int(config["CONVERSATION_LENGTH"])
+    CONVERSATION_TEMPERATURE = config["CONVERSATION_TEMPERATURE"]
+    CONVINCE_TIME = int(config["CONVINCE_TIME"])
+    CONVINCE_TIME_DEFINITIVE = int(config["CONVINCE_TIME_DEFINITIVE"])
+    FREQUENCY_PENALTY = config["FREQUENCY_PENALTY"]
+    PRESENCE_PENALTY = config["PRESENCE_PENALTY"]
+
+    global response_cache
+    if CACHE_RESPONSES:
+        response_cache = ResponseCache()
+    shared_metrics.log_file = METRICS_LOG
+
+    # ============ CONNECTION PHASE ============
+    try:
+        asyncio.run(serve(config))
+    except KeyboardInterrupt:  # Handle the keyboard interruption
+        print("\nSe ha cerrado el servidor manualmente.")
 
 
 if __name__ == '__main__':
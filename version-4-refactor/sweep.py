@@ -0,0 +1,217 @@
+import os
+import csv
+import sys
+import json
+import random
+import argparse
+import itertools
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from utils.scheduler_utils import shared_scheduler
+from utils.metrics_utils import shared_metrics
+from batch import run_debate
+
+# Parameter sweeps over the advanced settings of the interface, run as headless debates.
+# Grid:   python sweep.py cofigs-saves/basic.json --grid CONVERSATION_TEMPERATURE=0.5,1,1.5 FREQUENCY_PENALTY=0,0.8
+# Random: python sweep.py cofigs-saves/basic.json --random 20 --grid CONVERSATION_TEMPERATURE=0:2 CONVINCE_TIME=1:4
+
+# Settings that can be swept, with their type and valid range (as in the advanced tab of the interface)
+SWEEP_KEYS = {
+    "CONVERSATION_TEMPERATURE": (float, 0, 2),
+    "FREQUENCY_PENALTY": (float, -2, 2),
+    "PRESENCE_PENALTY": (float, -2, 2),
+    "CONVINCE_TIME": (int, 0, None),
+    "CONVINCE_TIME_DEFINITIVE": (int, 0, None),
+}
+
+RESULT_COLUMNS = [
+    'job', *SWEEP_KEYS, 'status', 'winner', 'messages', 'elapsed', 'calls',
+    'wall_time_p50', 'wall_time_p90', 'ttft_p50', 'queue_wait_total', 'prompt_tokens', 'completion_tokens',
+]
+
+
+def parse_value(key, value):
+    """
+    Convert a value of the command line to the type of its setting, checking its range.
+    """
+    if key not in SWEEP_KEYS:
+        raise ValueError(f"{key} no se puede barrer, opciones: {', '.join(SWEEP_KEYS)}")
+    kind, low, high = SWEEP_KEYS[key]
+    value = kind(value)
+    if value < low or (high is not None and value > high):
+        raise ValueError(f"{key}={value} fuera de rango")
+    return value
+
+
+def parse_grid(specs):
+    """
+    Parse the swept settings: KEY=v1,v2,... (values) or KEY=low:high (range, only for random search).
+    Outputs:
+    - grid: dictionary with the list of values or the (low, high) range of every setting
+    """
+    grid = {}
+    for spec in specs:
+        key, values = spec.split('=', 1)
+        if ':' in values:
+            low, high = values.split(':', 1)
+            grid[key] = (parse_value(key, low), parse_value(key, high))
+        else:
+            grid[key] = [parse_value(key, value) for value in values.split(',')]
+    return grid
+
+
+def expand_grid(grid):
+    """
+    Every combination of the values of the grid.
+    Outputs:
+    - points: generator of dictionaries with one value per setting
+    """
+    if any(isinstance(values, tuple) for values in grid.values()):
+        raise ValueError("Los rangos (low:high) solo se pueden usar en búsqueda aleatoria")
+    keys = list(grid)
+    for values in itertools.product(*(grid[key] for key in keys)):
+        yield dict(zip(keys, values))
+
+
+def sample_grid(grid, samples, seed=None):
+    """
+    Random points of the grid: ranges are sampled uniformly, lists of values are sampled from.
+    Outputs:
+    - points: list of dictionaries with one value per setting
+    """
+    rng = random.Random(seed)
+    points = []
+    for _ in range(samples):
+        point = {}
+        for key, values in grid.items():
+            if isinstance(values, tuple):
+                low, high = values
+                point[key] = rng.randint(low, high) if SWEEP_KEYS[key][0] is int else round(rng.uniform(low, high), 2)
+            else:
+                point[key] = rng.choice(values)
+        points.append(point)
+    return points
+
+
+def make_jobs(config_paths, points, repeat=1):
+    """
+    Build a debate job for every configuration, point of the sweep and repetition.
+    Outputs:
+    - jobs: list of (job id, point, configuration)
+    """
+    jobs = []
+    for path in config_paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            base_config = json.load(f)
+        name = os.path.splitext(os.path.basename(path))[0]
+        for p, point in enumerate(points):
+            for i in range(repeat):
+                jobs.append((f"{name}-p{p:03d}-{i:02d}", point, dict(base_config, **point)))
+    return jobs
+
+
+def result_row(job_id, point, result=None, error=None):
+    """
+    Row of the results table of a debate.
+    """
+    row = dict(point, job=job_id, status="ok" if error is None else f"error: {error}")
+    if result is None:
+        return row
+    calls = shared_metrics.summary(by='session', session=job_id).get(job_id, {})
+    row.update({
+        'winner': result['winner'],
+        'messages': result['messages'],
+        'elapsed': round(result['elapsed'], 3),
+        'calls': calls.get('calls', 0),
+    })
+    if calls:
+        row.update({
+            'wall_time_p50': calls['wall_time']['p50'],
+            'wall_time_p90': calls['wall_time']['p90'],
+            'ttft_p50': calls['ttft']['p50'],
+            'queue_wait_total': calls['queue_wait']['total'],
+            'prompt_tokens': calls['prompt_tokens']['total'],
+            'completion_tokens': calls['completion_tokens']['total'],
+        })
+    return row
+
+
+def run_sweep(jobs, output_dir="sweep", workers=4):
+    """
+    Run the debates of a sweep in a pool of threads, so every debate goes through the same rate limiter.
+    Every row is appended to results.csv as soon as its debate finishes.
+    Attributes:
+    - jobs: list of (job id, point, configuration)
+    - output_dir: directory of the transcripts and the results table
+    - workers: debates at the same time
+    Outputs:
+    - rows: rows of the results table
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    rows = []
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sweep") as executor, \
+            open(os.path.join(output_dir, "results.csv"), 'w', encoding='utf-8', newline='') as results_file:
+        writer = csv.DictWriter(results_file, RESULT_COLUMNS)
+        writer.writeheader()
+        futures = {executor.submit(run_debate, job_id, config, output_dir): (job_id, point) for job_id, point, config in jobs}
+        for future in as_completed(futures):
+            job_id, point = futures[future]
+            try:
+                row = result_row(job_id, point, future.result())
+            except Exception as e:
+                row = result_row(job_id, point, error=e)
+            rows.append(row)
+            writer.writerow(row)
+            results_file.flush()
+            print(f"[{len(rows)}/{len(jobs)}] {job_id} {point}: {row['status']}")
+    return rows
+
+
+def print_table(rows):
+    """
+    Print the results table grouped by point of the sweep (averages of the repetitions).
+    """
+    groups = {}
+    for row in rows:
+        if row['status'] == "ok":
+            groups.setdefault(tuple((key, row[key]) for key in SWEEP_KEYS if key in row), []).append(row)
+    for point, group in sorted(groups.items()):
+        settings = ", ".join(f"{key}={value}" for key, value in point)
+        elapsed = sum(row['elapsed'] for row in group) / len(group)
+        latency = sum(row.get('wall_time_p50') or 0 for row in group) / len(group)
+        tokens = sum((row.get('prompt_tokens') or 0) + (row.get('completion_tokens') or 0) for row in group) / len(group)
+        print(f"{settings} | debates: {len(group)} | duración: {elapsed:.1f} s | latencia p50: {latency:.2f} s | tokens: {tokens:.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Barrido de parámetros de los debates")
+    parser.add_argument('configs', nargs='+', help="configuraciones base (cofigs-saves/*.json)")
+    parser.add_argument('--grid', nargs='+', required=True, help="CLAVE=v1,v2,... o CLAVE=min:max (solo con --random)")
+    parser.add_argument('--random', type=int, default=None, help="número de puntos aleatorios en lugar de la rejilla completa")
+    parser.add_argument('--seed', type=int, default=None, help="semilla de la búsqueda aleatoria")
+    parser.add_argument('--repeat', type=int, default=1, help="debates por punto y configuración")
+    parser.add_argument('--workers', type=int, default=4, help="debates simultáneos")
+    parser.add_argument('--output', default="sweep", help="directorio de las transcripciones y resultados")
+    args = parser.parse_args()
+
+    try:
+        grid = parse_grid(args.grid)
+        points = sample_grid(grid, args.random, args.seed) if args.random else list(expand_grid(grid))
+    except ValueError as e:
+        print(f"Error en la rejilla: {e}")
+        sys.exit(1)
+
+    jobs = make_jobs(args.configs, points, args.repeat)
+    print(f"{len(points)} puntos, {len(jobs)} debates")
+    try:
+        rows = run_sweep(jobs, args.output, args.workers)
+    except KeyboardInterrupt:
+        print("\nSe ha detenido el barrido manualmente.")
+        sys.exit(1)
+    print_table(rows)
+    print("Planificador de peticiones:", shared_scheduler.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,380 @@
+import math
+import time
+import threading
+import pyaudio
+import numpy as np
+
+from fractions import Fraction
+
+
+def level_db(value):
+    """
+    Level of a 16 bit amplitude in dBFS (None for silence).
+    """
+    return 20 * math.log10(value / 32768) if value > 0 else None
+
+
+class AutomaticGain:
+    """
+    Automatic gain control for 16 bit audio, applied chunk by chunk as it is recorded.
+    The RMS and peak of every block are computed at once, the gain that brings each block to the target
+    level (capped so its peak stays below the peak limit) is smoothed across blocks (exponentially, as a
+    convolution) and ramped sample by sample from one block to the next, and the samples are amplified in
+    place. Blocks below the noise level keep the current gain, so silence is not boosted. Long chunks are
+    processed in segments through two scratch buffers, so no temporary array grows with the recording.
+    The gain is kept between recordings (same microphone and room) and the level statistics are kept per recording.
+    """
+    def __init__(self, rate, target_db=-20.0, noise_db=-50.0, min_gain=0.5, max_gain=20.0, peak=0.95, block=0.02, smoothing=0.8, segment_blocks=16):
+        self.block = max(1, int(rate * block))
+        self.target = 32768 * 10 ** (target_db / 20)  # RMS of the amplified speech
+        self.noise = 32768 * 10 ** (noise_db / 20)  # RMS below which a block is silence
+        self.min_gain = min_gain
+        self.max_gain = max_gain
+        self.peak = peak * 32767  # Peak normalization limit
+        self.smoothing = smoothing  # Weight of the previous gain in every block
+        self.kernel = smoothing ** np.arange(int(math.log(1e-6) / math.log(smoothing)) + 1)  # Truncated once negligible
+        self.ramp = np.arange(1, self.block + 1, dtype=np.float32) / self.block  # From the previous gain to the gain of the block
+        self.audio = np.empty(self.block * segment_blocks, dtype=np.float32)  # Scratch buffers of one segment
+        self.gains = np.empty(self.block * segment_blocks, dtype=np.float32)
+        self.gain = 1.0
+        self.reset()
+
+    def reset(self):
+        """
+        Start the statistics of a new recording.
+        """
+        self.samples = 0
+        self.clipped = 0  # Samples captured at full scale (clipped by the microphone)
+        self.energy_in = 0.0
+        self.energy_out = 0.0
+        self.peak_in = 0.0
+        self.gain_total = 0.0
+
+    def process(self, samples):
+        """
+        Amplify a chunk in place.
+        Attributes:
+        - samples: int16 array (modified in place)
+        Outputs:
+        - samples: the same array
+        """
+        for start in range(0, len(samples), len(self.audio)):
+            self._process_segment(samples[start:start + len(self.audio)])
+        return samples
+
+    def _process_segment(self, samples):
+        """
+        Amplify up to one scratch buffer of samples in place.
+        """
+        size = len(samples)
+        audio, gains = self.audio[:size], self.gains[:size]
+        np.copyto(audio, samples, casting='unsafe')
+        starts = np.arange(0, size, self.block)
+        sizes = np.diff(np.append(starts, size))
+
+        energy = np.add.reduceat(np.square(audio, out=gains), starts)
+        peaks = np.maximum.reduceat(np.abs(audio, out=gains), starts)
+        self.clipped += int(np.count_nonzero(gains >= 32767))
+        rms = np.sqrt(energy / sizes)
+
+        desired = np.where(rms > self.noise, np.clip(self.target / np.maximum(rms, 1), self.min_gain, self.max_gain), self.gain)
+        desired = np.minimum(desired, self.peak / np.maximum(peaks, 1))
+        decay = self.smoothing ** np.arange(1, len(desired) + 1)
+        smoothed = decay * self.gain + (1 - self.smoothing) * np.convolve(desired, self.kernel)[:len(desired)]
+        previous = np.append(self.gain, smoothed[:-1])
+        self.gain = float(smoothed[-1])
+
+        full = size // self.block
+        ramps = gains[:full * self.block].reshape(full, self.block)
+        np.multiply((smoothed[:full] - previous[:full])[:, None], self.ramp, out=ramps)
+        ramps += previous[:full, None].astype(np.float32)
+        if full < len(smoothed):  # Shorter last block
+            tail = np.arange(1, sizes[-1] + 1, dtype=np.float32) / sizes[-1]
+            gains[full * self.block:] = previous[-1] + (smoothed[-1] - previous[-1]) * tail
+
+        audio *= gains
+        np.round(audio, out=audio)
+        np.clip(audio, -32768, 32767, out=audio)
+        np.copyto(samples, audio, casting='unsafe')
+
+        self.samples += size
+        self.energy_in += float(energy.sum())
+        self.energy_out += float(np.dot(audio, audio))
+        self.peak_in = max(self.peak_in, float(peaks.max()))
+        self.gain_total += float(gains.sum(dtype=np.float64))
+
+    def stats(self):
+        """
+        Levels of the current recording.
+        Outputs:
+        - stats: input RMS and peak and output RMS (dBFS), mean gain and ratio of clipped input samples
+        """
+        if not self.samples:
+            return None
+        return {
+            'input_rms_db': level_db(math.sqrt(self.energy_in / self.samples)),
+            'input_peak_db': level_db(self.peak_in),
+            'output_rms_db': level_db(math.sqrt(self.energy_out / self.samples)),
+            'mean_gain': self.gain_total / self.samples,
+            'clipping_ratio': self.clipped / self.samples,
+        }
+
+
+def trim_silence(samples, rate, threshold_db=-35.0, min_rms=100.0, block=0.02, padding=0.3):
+    """
+    Energy based voice activity trimming: drop the silence before the first and after the last
+    block loud enough to be speech. The RMS of every block is computed at once over a reshaped view.
+    Attributes:
+    - samples: int16 array
+    - rate: sample rate
+    - threshold_db: level of a speech block relative to the loudest block
+    - min_rms: minimum RMS of a speech block (noise floor), below it the whole recording is silence
+    - block: seconds per block
+    - padding: seconds of audio kept before and after the speech
+    Outputs:
+    - speech: view of the samples with the speech (empty if there is none)
+    """
+    size = max(1, int(rate * block))
+    blocks = samples[:len(samples) // size * size].reshape(-1, size)
+    if not len(blocks):
+        return samples
+    rms = np.sqrt(np.square(blocks, dtype=np.float32).mean(axis=1))
+    threshold = max(min_rms, rms.max() * 10 ** (threshold_db / 20))
+    active = np.flatnonzero(rms >= threshold)
+    if not len(active):
+        return samples[:0]
+    pad = int(rate * padding)
+    return samples[max(0, active[0] * size - pad):(active[-1] + 1) * size + pad]
+
+
+class Resampler:
+    """
+    Polyphase resampler for 16 bit audio. Every output sample is the input interpolated at its exact
+    position with a Kaiser windowed-sinc low-pass filter, cut below the Nyquist frequency of the output
+    so nothing above it folds back into the speech band. The ratio of the rates is a fraction, so there
+    are only a few distinct positions between two input samples: their filters are computed once and
+    every output sample is a dot product. It keeps the tail of the previous chunk, so audio can be
+    resampled chunk by chunk as it is recorded with the same result as all at once.
+    """
+    def __init__(self, rate, target_rate, taps=160, cutoff=0.9, beta=8.0):
+        step = Fraction(rate, target_rate).limit_denominator(1000)
+        self.up = step.denominator  # Distinct positions between two input samples
+        self.down = step.numerator  # Output sample i is at input position i * down / up
+        self.half = taps // 2
+
+        # Filter of every position p / up: tap j weighs the input sample at floor(position) - half + 1 + j
+        cutoff *= min(1.0, target_rate / rate)  # Relative to the Nyquist frequency of the input
+        distances = np.arange(taps) - self.half + 1 - np.arange(self.up)[:, None] / self.up
+        window = np.i0(beta * np.sqrt(np.clip(1 - (distances / self.half) ** 2, 0, None))) / np.i0(beta)
+        filters = cutoff * np.sinc(cutoff * distances) * window
+        self.filters = (filters / filters.sum(axis=1, keepdims=True)).astype(np.float32)  # Unity gain at 0 Hz
+
+        self.history = np.zeros(self.half - 1, dtype=np.float32)  # Input not consumed yet (silence before the start)
+        self.position = (self.half - 1) * self.up  # Position of the next output sample in the history, in 1/up samples
+
+    def process(self, samples):
+        """
+        Resample a chunk.
+        Attributes:
+        - samples: int16 array
+        Outputs:
+        - resampled: int16 array (it can be empty for very short chunks)
+        """
+        audio = np.concatenate((self.history, samples.astype(np.float32)))
+        last = (len(audio) - self.half) * self.up - 1  # Last position with all its taps available
+        count = max(0, (last - self.position) // self.down + 1)
+        if count == 0:
+            self.history = audio
+            return np.zeros(0, dtype=np.int16)
+        positions = self.position + self.down * np.arange(count, dtype=np.int64)
+
+        windows = np.lib.stride_tricks.sliding_window_view(audio, len(self.filters[0]))
+        resampled = np.einsum('ij,ij->i', windows[positions // self.up - self.half + 1], self.filters[positions % self.up])
+
+        next_position = self.position + self.down * count
+        consumed = min(len(audio), next_position // self.up - self.half + 1)
+        self.history = audio[consumed:]
+        self.position = next_position - consumed * self.up
+        return np.clip(np.round(resampled), -32768, 32767).astype(np.int16)
+
+
+def resample(samples, rate, target_rate, block=1 << 16):
+    """
+    Resample a whole recording (see Resampler), in blocks of samples to bound the memory used.
+    """
+    if rate == target_rate:
+        return samples
+    resampler = Resampler(rate, target_rate)
+    padded = np.concatenate((samples, np.zeros(resampler.half, dtype=np.int16)))  # Flush the last samples
+    return np.concatenate([resampler.process(padded[i:i + block]) for i in range(0, len(padded), block)])
+
+
+class CaptureBuffer:
+    """
+    Preallocated buffer where the microphone callback writes the samples of a turn.
+    It is rewound at the start of every turn and only grows (doubling its size) when a turn
+    is longer than any previous one, so recording does not allocate per chunk or per turn.
+    """
+    def __init__(self, seconds=60, rate=44100):
+        self.samples = np.zeros(seconds * rate, dtype=np.int16)
+        self.length = 0  # Samples written in the current turn
+
+    def write(self, data):
+        """
+        Append a chunk of 16 bit PCM audio.
+        Outputs:
+        - chunk: view of the chunk inside the buffer
+        """
+        chunk = np.frombuffer(data, dtype=np.int16)
+        start, end = self.length, self.length + len(chunk)
+        if end > len(self.samples):
+            grown = np.zeros(max(end, 2 * len(self.samples)), dtype=np.int16)
+            grown[:start] = self.samples[:start]
+            self.samples = grown
+        self.samples[start:end] = chunk
+        self.length = end
+        return self.samples[start:end]
+
+    def rewind(self):
+        self.length = 0
+
+    def view(self):
+        """
+        Samples of the current turn (a view of the buffer, valid until the next rewind).
+        """
+        return self.samples[:self.length]
+
+
+class AudioEngine:
+    """
+    Owner of the audio devices of the process.
+    A single PyAudio instance is created once, the microphone stream is opened up front and stays
+    open (recording is turned on and off with a flag) and output streams are kept open, one per
+    audio format, instead of paying the PortAudio setup on every turn.
+    """
+    def __init__(self, rate=44100, channels=1, chunk=1024, output_rate=24000):
+        self.rate = rate
+        self.channels = channels
+        self.chunk = chunk
+        self.sample_width = pyaudio.get_sample_size(pyaudio.paInt16)
+
+        self.lock = threading.Lock()
+        self.play_lock = threading.Lock()  # One utterance at a time, never interleaved
+        self.buffer = CaptureBuffer(rate=rate)
+        self.recording = False
+        self.on_chunk = None  # Called with every chunk recorded (eg. to stream it to the recognizer)
+
+        start = time.perf_counter()
+        self.pa = pyaudio.PyAudio()
+        self.init_time = time.perf_counter() - start  # Seconds PortAudio took to initialize
+
+        start = time.perf_counter()
+        self.input_stream = self.pa.open(
+            format=pyaudio.paInt16,
+            channels=channels,
+            rate=rate,
+            input=True,
+            frames_per_buffer=chunk,
+            stream_callback=self._audio_callback,
+        )
+        self.input_stream.start_stream()
+        self.input_open_time = time.perf_counter() - start
+
+        self.output_streams = {}  # (sample width, channels, rate) -> (stream, seconds it took to open)
+        self._open_output_stream(self.sample_width, 1, output_rate)  # Format of the synthesized speech (LINEAR16)
+
+        self.turns_recorded = 0
+        self.utterances_played = 0
+        self.setup_saved = 0.0  # Device setup time avoided by reusing the instance and the streams
+
+    def _audio_callback(self, in_data, frame_count, time_info, status):
+        """
+        Callback of the microphone stream, keeps the audio only while recording.
+        """
+        with self.lock:
+            if self.recording:
+                chunk = self.buffer.write(in_data)
+                if self.on_chunk is not None:
+                    self.on_chunk(chunk)
+        return (in_data, pyaudio.paContinue)
+
+    def start_recording(self, on_chunk=None):
+        """
+        Start recording from the microphone (non-blocking).
+        Attributes:
+        - on_chunk: function called from the audio thread with a view of every recorded chunk (optional)
+        """
+        with self.lock:
+            self.setup_saved += self.init_time + self.input_open_time
+            self.buffer.rewind()
+            self.on_chunk = on_chunk
+            self.recording = True
+
+    def stop_recording(self):
+        """
+        Stop recording.
+        Outputs:
+        - samples: int16 array with the recorded audio, a view of the capture buffer valid until the next recording
+        """
+        with self.lock:
+            self.recording = False
+            self.on_chunk = None
+            self.turns_recorded += 1
+            return self.buffer.view()
+
+    def _open_output_stream(self, sample_width, channels, rate):
+        start = time.perf_counter()
+        stream = self.pa.open(format=self.pa.get_format_from_width(sample_width), channels=channels, rate=rate, output=True)
+        self.output_streams[(sample_width, channels, rate)] = (stream, time.perf_counter() - start)
+        return stream
+
+    def _output_stream(self, sample_width, channels, rate):
+        """
+        Output stream for an audio format, opened only the first time the format is seen.
+        """
+        key = (sample_width, channels, rate)
+        with self.lock:
+            if key not in self.output_streams:
+                return self._open_output_stream(sample_width, channels, rate)
+            stream, open_time = self.output_streams[key]
+            self.setup_saved += self.init_time + open_time
+            return stream
+
+    def play(self, audio, sample_width, channels, rate):
+        """
+        Play audio (blocking).
+        Attributes:
+        - audio: PCM audio
+        - sample_width: bytes per sample
+        - channels: number of channels
+        - rate: sample rate
+        """
+        stream = self._output_stream(sample_width, channels, rate)
+        step = self.chunk * sample_width * channels
+        with self.play_lock:
+            for i in range(0, len(audio), step):
+                stream.write(audio[i:i + step])
+            self.utterances_played += 1
+
+    def stats(self):
+        """
+        Setup times of the devices and the setup time saved by reusing them.
+        """
+        with self.lock:
+            return {
+                'init_time': self.init_time,
+                'input_open_time': self.input_open_time,
+                'output_open_times': {f"{rate} Hz": open_time for (_, _, rate), (_, open_time) in self.output_streams.items()},
+                'turns_recorded': self.turns_recorded,
+                'utterances_played': self.utterances_played,
+                'setup_saved': self.setup_saved,
+            }
+
+    def close(self):
+        with self.lock:
+            self.recording = False
+            for stream in [self.input_stream] + [stream for stream, _ in self.output_streams.values()]:
+                stream.stop_stream()
+                stream.close()
+            self.output_streams = {}
+            self.pa.terminate()
@@ -0,0 +1,237 @@
+import os
+import json
+import hashlib
+import threading
+
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    In-memory cache that discards the least recently used entries first.
+    """
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        """
+        Get a value, marking it as recently used.
+        Outputs:
+        - value: cached value, None if missing
+        """
+        if key not in self.entries:
+            return None
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+class DiskCache:
+    """
+    On-disk cache with one file per entry. When the total size exceeds max_bytes the least
+    recently used files (by modification time, refreshed on every hit) are deleted.
+    With shard_chars the files are spread in subdirectories named after the first characters
+    of the key, so no directory ends up with thousands of files.
+    """
+    def __init__(self, directory, max_bytes=50 * 1024 * 1024, extension=".bin", shard_chars=0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.extension = extension
+        self.shard_chars = shard_chars
+        os.makedirs(directory, exist_ok=True)
+
+        # Size of every file, to know the total without listing the directory on every write
+        self.sizes = {}
+        directories = [directory]
+        while directories:
+            for entry in os.scandir(directories.pop()):
+                if entry.is_dir():
+                    directories.append(entry.path)
+                elif entry.is_file() and entry.name.endswith(extension):
+                    self.sizes[entry.path] = entry.stat().st_size
+        self.total_bytes = sum(self.sizes.values())
+
+    def path(self, key):
+        if self.shard_chars:
+            return os.path.join(self.directory, key[:self.shard_chars], key + self.extension)
+        return os.path.join(self.directory, key + self.extension)
+
+    def get(self, key):
+        """
+        Read an entry from disk.
+        Outputs:
+        - data: cached bytes, None if missing
+        """
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)  # Mark as recently used
+        except FileNotFoundError:  # Missing or evicted by another process
+            return None
+        return data
+
+    def put(self, key, data):
+        path = self.path(key)
+        if self.shard_chars:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)  # Readers never see a half written file
+
+        self.total_bytes += len(data) - self.sizes.get(path, 0)
+        self.sizes[path] = len(data)
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """
+        Delete the least recently used files until the cache fits in max_bytes.
+        """
+        by_age = sorted(self.sizes, key=lambda path: os.stat(path).st_mtime if os.path.exists(path) else 0)
+        for path in by_age:
+            if self.total_bytes <= self.max_bytes:
+                break
+            self.total_bytes -= self.sizes.pop(path)
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class ResponseCache:
+    """
+    Cache of the responses generated by the models, keyed by a hash of everything that defines the
+    request (model, messages, temperature and penalties). Entries are looked up first in memory and
+    then on disk, so replays of the same configuration do not call the API at all.
+    """
+    def __init__(self, directory="response-cache", max_entries=256, max_bytes=50 * 1024 * 1024):
+        self.memory = LRUCache(max_entries)
+        self.disk = DiskCache(directory, max_bytes, extension=".json")
+        self.lock = threading.Lock()  # Shared by every debate of the process
+
+        self.hits = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model, messages, temperature, frequency_penalty, presence_penalty):
+        """
+        Hash the inputs of a request.
+        Outputs:
+        - key: hexadecimal SHA-256 of the request
+        """
+        request = json.dumps([model, messages, temperature, frequency_penalty, presence_penalty], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(request.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """
+        Get a cached response.
+        Outputs:
+        - response: cached response, None if missing
+        """
+        with self.lock:
+            response = self.memory.get(key)
+            if response is not None:
+                self.hits += 1
+                self.memory_hits += 1
+                return response
+
+            data = self.disk.get(key)
+            if data is not None:
+                response = json.loads(data)['response']
+                self.memory.put(key, response)
+                self.hits += 1
+                self.disk_hits += 1
+                return response
+
+            self.misses += 1
+            return None
+
+    def put(self, key, response):
+        with self.lock:
+            self.memory.put(key, response)
+            self.disk.put(key, json.dumps({'response': response}, ensure_ascii=False).encode('utf-8'))
+
+    def stats(self):
+        """
+        Hit and miss counters of the cache.
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'disk_bytes': self.disk.total_bytes,
+            }
+
+
+class SpeechCache:
+    """
+    Cache of synthesized speech, keyed by a hash of the text, the voice and the audio encoding.
+    Entries only live on disk (audio is large), sharded by the first characters of the key, so
+    repeated lines and replays of archived debates are played without calling the TTS API.
+    """
+    def __init__(self, directory="tts-cache", max_bytes=200 * 1024 * 1024, shard_chars=2):
+        self.disk = DiskCache(directory, max_bytes, extension=".wav", shard_chars=shard_chars)
+        self.lock = threading.Lock()  # Shared by every thread that speaks
+
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0  # Audio read from the cache instead of synthesized
+
+    @staticmethod
+    def make_key(text, voice, encoding):
+        """
+        Hash the inputs of a synthesis.
+        Attributes:
+        - text: text to speak
+        - voice: parameters of the voice (language and name or gender)
+        - encoding: audio encoding
+        Outputs:
+        - key: hexadecimal SHA-256 of the synthesis
+        """
+        request = json.dumps([text, voice, encoding], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(request.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """
+        Get cached audio.
+        Outputs:
+        - audio: cached audio, None if missing
+        """
+        with self.lock:
+            audio = self.disk.get(key)
+            if audio is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.bytes_saved += len(audio)
+            return audio
+
+    def put(self, key, audio):
+        with self.lock:
+            self.disk.put(key, audio)
+
+    def stats(self):
+        """
+        Hit and miss counters of the cache.
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'bytes_saved': self.bytes_saved,
+                'disk_bytes': self.disk.total_bytes,
+            }
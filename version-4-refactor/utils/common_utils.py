@@ -1,94 +1,266 @@
+import io
 import os
-import signal
 import wave
-import pyaudio
+import queue
+import atexit
+import signal
+import time
+import itertools
+import threading
 import numpy as np
 
+from concurrent.futures import ThreadPoolExecutor
+
+import grpc
 from google.cloud import texttospeech, speech
 
 from interface.interface import SpeakingWindow
+from utils.cache_utils import SpeechCache
+from utils.audio_utils import AudioEngine, AutomaticGain, Resampler, trim_silence, resample
 
 
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "./google-credentials.json" # Set the Google credentials
 
-# global variables to control the audio
-frames = []
-audio_stream = None
-p_audio = None
+AUDIO_ARCHIVE_DIR = None  # Directory where the recorded and spoken audio is saved in the background (None to disable)
+STREAMING_STT = True  # Recognize the speech while it is being recorded instead of after STOP
+TTS_CACHE_DIR = "tts-cache"  # Directory of the synthesized speech cache (None to disable)
+AGC_TARGET_DB = -20.0  # Level (dBFS) the automatic gain control brings the speech to
+STT_RATE = 16000  # Sample rate of the audio sent to the recognizer (enough for speech, 2.75x less than the capture)
+VAD_THRESHOLD_DB = -35.0  # Blocks quieter than this (relative to the loudest one) are silence trimmed before recognition
+
+# Audio devices of the process, created on first use
+audio_engine = None
+audio_engine_lock = threading.Lock()
+
+# Synthesized speech cache, created on first use
+tts_cache = None
+tts_cache_lock = threading.Lock()
+
+# Writes archived audio off the critical path
+archive_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="audio-archive")
+archive_counter = itertools.count()
+
+# Speech recognition of the turn being recorded and delay from STOP to the transcript of every turn
+transcriber = None
+stt_delays = {'streaming': [], 'batch': []}
+stt_bytes = {'recorded': 0, 'sent': 0}  # Audio captured vs uploaded to the recognizer
+
+# Automatic gain control of the microphone and levels of every recording
+gain_control = None
+capture_levels = []
 
 # global variable interface
 speaking_window = None
 program_pid = os.getpid()
 
 
-def _audio_callback(in_data, frame_count, time_info, status):
+class SpeechServices:
+    """
+    Long-lived Google Speech-to-Text and Text-to-Speech clients of the process.
+    Creating a client loads the credentials and its gRPC channel connects on the first request, so the
+    clients are created once, can be connected before the conversation starts, and are shared by every
+    thread (the clients are thread safe and their channel carries concurrent requests).
+    """
+    def __init__(self):
+        self.lock = threading.Lock()  # Only held to create the clients, never during a request
+        self.pid = os.getpid()
+        self.clients = {}
+        self.connect_times = {}  # Seconds to create and connect every client
+        self.request_times = {}  # Service -> [requests, total seconds, max seconds]
+
+    def client(self, service):
+        """
+        Get the client of a service ("speech" or "tts"), creating it on the first call.
+        """
+        with self.lock:
+            if self.pid != os.getpid():  # gRPC channels can not be shared with a forked process
+                self.pid = os.getpid()
+                self.clients = {}
+            if service not in self.clients:
+                start = time.perf_counter()
+                client = speech.SpeechClient() if service == "speech" else texttospeech.TextToSpeechClient()
+                self.clients[service] = client
+                self.connect_times[service] = time.perf_counter() - start
+            return self.clients[service]
+
+    def connect(self, service, timeout=5):
+        """
+        Create the client of a service and open its channel without making any request.
+        Best effort: if it fails (eg. missing credentials) the client is created again on the first request.
+        """
+        try:
+            client = self.client(service)
+        except Exception as e:  # Eg. missing credentials, the request will fail like without warming up
+            print(f"No se pudo crear el cliente del servicio {service}: {e}")
+            return
+        start = time.perf_counter()
+        try:
+            grpc.channel_ready_future(client.transport.grpc_channel).result(timeout=timeout)
+        except Exception as e:  # The channel will connect on the first request
+            print(f"No se pudo conectar de antemano con el servicio {service}: {e}")
+        with self.lock:
+            self.connect_times[service] += time.perf_counter() - start
+
+    def record(self, service, seconds):
+        """
+        Record the duration of a request.
+        """
+        with self.lock:
+            times = self.request_times.setdefault(service, [0, 0.0, 0.0])
+            times[0] += 1
+            times[1] += seconds
+            times[2] = max(times[2], seconds)
+
+    def stats(self):
+        """
+        Connection time of every client vs the time of its requests.
+        """
+        with self.lock:
+            return {
+                'connect_times': dict(self.connect_times),
+                'requests': {
+                    service: {'requests': count, 'mean': total / count, 'max': longest}
+                    for service, (count, total, longest) in self.request_times.items()
+                },
+            }
+
+
+speech_services = SpeechServices()
+
+
+def get_audio_engine():
     """
-    Callback for non-blocking audio recording
+    Get the AudioEngine of the process, creating it (and initializing PortAudio) on the first call.
     """
-    frames.append(in_data)
-    return (in_data, pyaudio.paContinue)
+    global audio_engine
+    with audio_engine_lock:
+        if audio_engine is None:
+            audio_engine = AudioEngine()
+            atexit.register(audio_engine.close)
+        return audio_engine
+
+def warm_up_audio():
+    """
+    Open the audio devices and connect to the Google speech services before the conversation starts,
+    so the first turn does not pay their setup.
+    Best effort: if something fails it is set up again when it is first used, like without warming up.
+    """
+    try:
+        get_audio_engine()
+    except Exception as e:
+        print(f"No se pudieron abrir los dispositivos de audio de antemano: {e}")
+    for service in ("speech", "tts"):
+        speech_services.connect(service)
+
+def audio_stats():
+    """
+    Device setup statistics of the AudioEngine, None if audio was never used.
+    """
+    return audio_engine.stats() if audio_engine is not None else None
+
+def stt_stats():
+    """
+    Delay from STOP to the transcript, per recognition mode.
+    Outputs:
+    - stats: dictionary with the turns, mean and max delay (seconds) of streaming and batch recognition,
+      and the bytes recorded and uploaded
+    """
+    stats = {
+        mode: {'turns': len(delays), 'mean': sum(delays) / len(delays) if delays else None, 'max': max(delays, default=None)}
+        for mode, delays in stt_delays.items()
+    }
+    stats['bytes'] = dict(stt_bytes)
+    return stats
+
+def capture_stats():
+    """
+    Capture quality: levels of the last recording and worst clipping ratio of all of them.
+    """
+    if not capture_levels:
+        return None
+    return {
+        'recordings': len(capture_levels),
+        'last': capture_levels[-1],
+        'max_clipping_ratio': max(levels['clipping_ratio'] for levels in capture_levels),
+        'mean_gain': sum(levels['mean_gain'] for levels in capture_levels) / len(capture_levels),
+    }
+
+def get_tts_cache():
+    """
+    Get the SpeechCache of the process, None if TTS_CACHE_DIR is None.
+    """
+    global tts_cache
+    with tts_cache_lock:
+        if tts_cache is None and TTS_CACHE_DIR is not None:
+            tts_cache = SpeechCache(TTS_CACHE_DIR)
+        return tts_cache
+
+def tts_stats():
+    """
+    Hit rate and bytes saved by the synthesized speech cache, None if it was never used.
+    """
+    return tts_cache.stats() if tts_cache is not None else None
+
+def speech_services_stats():
+    """
+    Connection and request times of the Google speech services.
+    """
+    return speech_services.stats()
 
 def hear():
     """
     Non-blocking audio recording function
     """
-    global frames, audio_stream, p_audio
-    
-    # Reset frames array
-    frames = []
-    
-    # Initialize PyAudio
-    p_audio = pyaudio.PyAudio()
-    
-    # Open audio stream (non-blocking)
-    audio_stream = p_audio.open(
-        format=pyaudio.paInt16,
-        channels=1,
-        rate=44100,
-        input=True,
-        frames_per_buffer=1024,
-        stream_callback=_audio_callback
-    )
-    
-    # Start the stream
-    audio_stream.start_stream()
+    global transcriber, gain_control
+    engine = get_audio_engine()
+    if gain_control is None:
+        gain_control = AutomaticGain(engine.rate, AGC_TARGET_DB)
+    gain_control.reset()
+    if STREAMING_STT:
+        transcriber = StreamingTranscriber(engine.rate, STT_RATE)
+        # Every chunk is amplified in the capture buffer and sent to the recognizer as soon as it is recorded
+        engine.start_recording(on_chunk=lambda chunk: transcriber.feed(gain_control.process(chunk)))
+    else:
+        transcriber = None
+        engine.start_recording()
 
 def stop_hearing():
     """
     Stop recording and process the audio
     """
-    global audio_stream, p_audio, frames
-    
-    if audio_stream:
-        # Stop and close the stream
-        audio_stream.stop_stream()
-        audio_stream.close()
-        p_audio.terminate()
-        
-        # Process the recorded audio
-        audio_data = b''.join(frames)
-        audio_array = np.frombuffer(audio_data, dtype=np.int16)
-        
-        # Amplify the audio
-        gain_factor = 5.0
-        amplified_audio_array = np.clip(audio_array * gain_factor, -32768, 32767)
-        amplified_audio_data = amplified_audio_array.astype(np.int16).tobytes()
-        
-        # Save to WAV file
-        filename = "recorded_speech.wav"
-        if os.path.exists(filename):
-            os.remove(filename)
-            
-        wf = wave.open(filename, 'wb')
-        wf.setnchannels(1)
-        wf.setsampwidth(p_audio.get_sample_size(pyaudio.paInt16))
-        wf.setframerate(44100)
-        wf.writeframes(amplified_audio_data)
-        wf.close()
+    global transcriber
+    engine = get_audio_engine()
+    if engine.recording:
+        # Stop recording (the stream stays open for the next turn)
+        samples = engine.stop_recording()
+        stop_time = time.perf_counter()
+        streaming, transcriber = transcriber, None
+
+        if streaming is None:
+            # Amplify the audio (in place, in the capture buffer)
+            gain_control.process(samples)
+        levels = gain_control.stats()
+        if levels is not None:
+            capture_levels.append(levels)
+
+        archive_audio("recorded", samples, engine.sample_width, 1, engine.rate)
+        stt_bytes['recorded'] += samples.nbytes
         
         # Convert to text
         try:
-            text = speech_to_text(filename)
+            text = None
+            if streaming is not None:
+                try:
+                    text = streaming.finish()  # Only the end of the audio is left to recognize
+                    stt_bytes['sent'] += streaming.bytes_sent
+                    stt_delays['streaming'].append(time.perf_counter() - stop_time)
+                except Exception as e:
+                    print(f"Error in streaming speech to text, recognizing the whole recording: {e}")
+            if text is None:
+                speech_audio = prepare_speech(samples, engine.rate)
+                stt_bytes['sent'] += speech_audio.nbytes
+                text = speech_to_text(speech_audio, STT_RATE) if len(speech_audio) else ""  # Nothing to recognize in silence
+                stt_delays['batch'].append(time.perf_counter() - stop_time)
             speaking_window.update_listening(text)
             return text
         except Exception as e:
@@ -102,96 +274,259 @@ def speak(text, change_voice=False):
     speaking_window.update_speaking(text)
     try:
         # Convert text to speech
-        output_file = 'temp_speech.wav'
-        text_to_speech(text, output_file, change_voice)
+        audio = text_to_speech(text, change_voice)
         
         speaking_window.update_avatar(is_open=False)
         # Play the audio (blocking)
-        play_audio(output_file)
+        play_audio(audio)
         speaking_window.update_avatar(is_open=True)
-        # Clean up
-        if os.path.exists(output_file):
-            os.remove(output_file)
             
     except Exception as e:
         print(f"Error in speak function: {e}")
 
-def speech_to_text(audio_file):
+def speak_stream(sentences, change_voice=False):
+    """
+    Blocking function to speak a response while it is still being generated.
+    Each sentence is converted to speech as soon as it arrives and queued for playback,
+    so the first sentence plays while the next ones are generated and synthesized.
+    Attributes:
+    - sentences: iterable with the sentences of the response
+    - change_voice: use the alternative voice
+    Outputs:
+    - text: full spoken text
+    """
+    playback_queue = queue.Queue()
+
+    def _player():
+        speaking_window.update_avatar(is_open=False)
+        while True:
+            audio = playback_queue.get()
+            if audio is None:  # No more sentences
+                break
+            try:
+                play_audio(audio)
+            except Exception as e:
+                print(f"Error in speak function: {e}")
+        speaking_window.update_avatar(is_open=True)
+
+    player = threading.Thread(target=_player, daemon=True)
+    player.start()
+
+    text = ""
+    try:
+        for sentence in sentences:
+            text += sentence
+            speaking_window.update_speaking(text)
+            if not sentence.strip():
+                continue
+            try:
+                playback_queue.put(text_to_speech(sentence.strip(), change_voice))  # Audio in memory, queued
+            except Exception as e:
+                print(f"Error in speak function: {e}")
+    finally:
+        playback_queue.put(None)
+        player.join()
+
+    return text
+
+def show_listened(text):
     """
-    Convert audio file to text using Google Cloud Speech-to-Text API.  
+    Show a text received from the other model without transcribing it.
+    """
+    speaking_window.update_listening(text)
+
+def prepare_speech(samples, rate):
+    """
+    Preprocess a recording before recognizing it: trim the silence around the speech and resample it to STT_RATE.
+    Attributes:
+    - samples: 16 bit mono PCM audio (int16 array)
+    - rate: sample rate of the audio
+    Outputs:
+    - audio: int16 array at STT_RATE (empty if the recording is silence)
+    """
+    return resample(trim_silence(samples, rate, VAD_THRESHOLD_DB), rate, STT_RATE)
+
+def speech_to_text(audio, rate=44100):
     """
-    client = speech.SpeechClient()
-    with open(audio_file, 'rb') as audio_file:
-        content = audio_file.read()
+    Convert audio to text using Google Cloud Speech-to-Text API.
+    Attributes:
+    - audio: 16 bit mono PCM audio
+    - rate: sample rate of the audio
+    """
+    client = speech_services.client("speech")
     
-    audio = speech.RecognitionAudio(content=content)
+    audio = speech.RecognitionAudio(content=bytes(audio))
     config = speech.RecognitionConfig(
         encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
-        sample_rate_hertz=44100,
+        sample_rate_hertz=rate,
         language_code="es-ES",
     )
     
+    start = time.perf_counter()
     response = client.recognize(config=config, audio=audio)
+    speech_services.record("speech", time.perf_counter() - start)
     
     return response.results[0].alternatives[0].transcript
 
-def text_to_speech(text, output_file, change_voice=False):
+class StreamingTranscriber:
+    """
+    Streaming recognition of a turn with Google Cloud Speech-to-Text.
+    The audio is sent while it is being recorded, so when the turn ends only its last
+    chunks are left to recognize instead of the whole recording.
+    The chunks are resampled to the recognition rate in the thread of the request, not in the audio thread.
+    """
+    def __init__(self, rate=44100, target_rate=STT_RATE, language_code="es-ES"):
+        self.chunks = queue.Queue()
+        self.resampler = Resampler(rate, target_rate)
+        self.transcripts = []  # Final results, in order
+        self.bytes_sent = 0
+        self.error = None
+        self.thread = threading.Thread(target=self._run, args=(target_rate, language_code), daemon=True)
+        self.thread.start()
+
+    def feed(self, audio):
+        """
+        Send a chunk of 16 bit mono PCM audio (called from the audio thread, does not block).
+        """
+        self.chunks.put(bytes(audio))
+
+    def _requests(self):
+        while True:
+            chunk = self.chunks.get()
+            if chunk is None:  # End of the turn
+                return
+            audio = self.resampler.process(np.frombuffer(chunk, dtype=np.int16)).tobytes()
+            self.bytes_sent += len(audio)
+            yield speech.StreamingRecognizeRequest(audio_content=audio)
+
+    def _run(self, rate, language_code):
+        try:
+            client = speech_services.client("speech")
+            config = speech.StreamingRecognitionConfig(
+                config=speech.RecognitionConfig(
+                    encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
+                    sample_rate_hertz=rate,
+                    language_code=language_code,
+                ),
+            )
+            for response in client.streaming_recognize(config=config, requests=self._requests()):
+                for result in response.results:
+                    if result.is_final and result.alternatives:
+                        self.transcripts.append(result.alternatives[0].transcript.strip())
+        except Exception as e:
+            self.error = e
+
+    def finish(self, timeout=10):
+        """
+        End the audio of the turn and wait for the last results.
+        Outputs:
+        - text: transcript of the turn
+        """
+        self.chunks.put(None)
+        self.thread.join(timeout)
+        if self.error is not None:
+            raise self.error
+        if self.thread.is_alive():
+            raise TimeoutError(f"no final result after {timeout} s")
+        return " ".join(self.transcripts)
+
+def text_to_speech(text, change_voice=False):
     """
     Convert text to speech using Google Cloud Text-to-Speech API.
+    The audio is looked up first in the speech cache and only synthesized on a miss.
+    Outputs:
+    - audio: synthesized speech (WAV)
     """
-    client = texttospeech.TextToSpeechClient()
+    if change_voice:
+        voice = {'language_code': "es-ES", 'ssml_gender': "NEUTRAL"}
+        print("Voice changed")
+    else:
+        voice = {'language_code': "es-ES", 'name': "es-ES-Standard-C"}
+    encoding = "LINEAR16"
+
+    cache = get_tts_cache()
+    if cache is not None:
+        key = SpeechCache.make_key(text, voice, encoding)
+        audio = cache.get(key)
+        if audio is not None:
+            return audio
+
+    client = speech_services.client("tts")
     synthesis_input = texttospeech.SynthesisInput(text=text)
 
-    if change_voice:
-        voice = texttospeech.VoiceSelectionParams(
-            language_code="es-ES",
-            ssml_gender=texttospeech.SsmlVoiceGender.NEUTRAL,
+    if 'ssml_gender' in voice:
+        voice_params = texttospeech.VoiceSelectionParams(
+            language_code=voice['language_code'],
+            ssml_gender=getattr(texttospeech.SsmlVoiceGender, voice['ssml_gender']),
         )
-        print("Voice changed")
     else:
-        voice = texttospeech.VoiceSelectionParams(
-            language_code="es-ES",
-            name="es-ES-Standard-C",
+        voice_params = texttospeech.VoiceSelectionParams(
+            language_code=voice['language_code'],
+            name=voice['name'],
         )
 
     audio_config = texttospeech.AudioConfig(
-        audio_encoding=texttospeech.AudioEncoding.LINEAR16
+        audio_encoding=getattr(texttospeech.AudioEncoding, encoding)
     )
+    start = time.perf_counter()
     response = client.synthesize_speech(
-        input=synthesis_input, voice=voice, audio_config=audio_config
+        input=synthesis_input, voice=voice_params, audio_config=audio_config
     )
+    speech_services.record("tts", time.perf_counter() - start)
 
-    with open(output_file, "wb") as out:
-        out.write(response.audio_content)
-        print(f'Audio content written to file {output_file}')
+    if cache is not None:
+        try:
+            cache.put(key, response.audio_content)
+        except OSError as e:
+            print(f"Error saving speech to the cache: {e}")
+    return response.audio_content
 
-def play_audio(file_path):
+def read_wav(data):
     """
-    Play the audio file using PyAudio.
+    Read WAV audio held in memory without copying its samples.
+    Attributes:
+    - data: WAV file contents
+    Outputs:
+    - audio: memoryview of the PCM samples
+    - sample_width, channels, rate: format of the samples
     """
-    # Open the WAV file
-    wf = wave.open(file_path, 'rb')
-    
-    # Initialize PyAudio
-    p = pyaudio.PyAudio()
-    
-    # Open stream
-    stream = p.open(format=p.get_format_from_width(wf.getsampwidth()),
-                    channels=wf.getnchannels(),
-                    rate=wf.getframerate(),
-                    output=True)
-    
-    # Read data in chunks and play
-    data = wf.readframes(1024)
-    while data:
-        stream.write(data)
-        data = wf.readframes(1024)
-    
-    # Clean up
-    stream.stop_stream()
-    stream.close()
-    p.terminate()
-    wf.close()
+    buffer = io.BytesIO(data)
+    with wave.open(buffer, 'rb') as wf:
+        start = buffer.tell()  # The header has been read, the samples start here
+        size = wf.getnframes() * wf.getsampwidth() * wf.getnchannels()
+        return memoryview(data)[start:start + size], wf.getsampwidth(), wf.getnchannels(), wf.getframerate()
+
+def play_audio(data):
+    """
+    Play WAV audio held in memory through the output stream of the AudioEngine.
+    """
+    audio, sample_width, channels, rate = read_wav(data)
+    archive_audio("spoken", audio, sample_width, channels, rate)
+    get_audio_engine().play(audio, sample_width, channels, rate)
+
+def archive_audio(kind, audio, sample_width, channels, rate):
+    """
+    Save audio to AUDIO_ARCHIVE_DIR in the background, if archiving is enabled.
+    Attributes:
+    - kind: prefix of the file name ("recorded" or "spoken")
+    - audio: PCM audio
+    - sample_width, channels, rate: format of the audio
+    """
+    if AUDIO_ARCHIVE_DIR is None:
+        return
+    path = os.path.join(AUDIO_ARCHIVE_DIR, f"{kind}-{program_pid}-{next(archive_counter):05d}.wav")  # Unique per process
+    archive_executor.submit(_write_wav, path, bytes(audio), sample_width, channels, rate)
+
+def _write_wav(path, audio, sample_width, channels, rate):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with wave.open(path, 'wb') as wf:
+            wf.setnchannels(channels)
+            wf.setsampwidth(sample_width)
+            wf.setframerate(rate)
+            wf.writeframes(audio)
+    except Exception as e:
+        print(f"Error archiving audio: {e}")
 
 def show_speaking_window(model, name):
     """
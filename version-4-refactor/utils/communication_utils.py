@@ -1,59 +1,255 @@
 import json
-import time
+import struct
 
+# Wire format: every message is a frame made of a fixed header followed by the payload
+# Header: payload length (4 bytes, big endian) + frame type (1 byte)
+FRAME_HEADER = struct.Struct('!IB')
+FRAME_TEXT = 0  # Plain UTF-8 text (handshake petitions)
+FRAME_JSON = 1  # UTF-8 encoded JSON object (commands, configuration, personalities...)
+MAX_FRAME_SIZE = 1024 * 1024  # Largest payload accepted, checked before allocating its buffer
 
-TIME_TO_SLEEP = 0.1
 
-def send_listen(conn):  # Signal other model that we are about to speak and should start listening
+def send_frame(conn, payload, frame_type=FRAME_JSON):
     """
-    Send a message asking to listen
+    Send a single framed message.
     Attributes:
     - conn: connection object
+    - payload: bytes to send
+    - frame_type: type of the frame (FRAME_TEXT or FRAME_JSON)
     """
-    time.sleep(TIME_TO_SLEEP) # Small delay to avoid race conditions
-    conn.sendall(json.dumps({
-        'name': "system",
-        'message': "LISTEN"
-    }).encode('utf-8'))
+    conn.sendall(FRAME_HEADER.pack(len(payload), frame_type) + payload)
 
 
-def send_speak(conn):
+def send_text(conn, text):
     """
-    Send a message asking to speak
+    Send a plain text frame.
     Attributes:
     - conn: connection object
+    - text: text to send
     """
-    time.sleep(TIME_TO_SLEEP) # Small delay to avoid race conditions
-    conn.sendall(json.dumps({
-        'name': "system",
-        'message': "SPEAK"
-    }).encode('utf-8'))
+    send_frame(conn, text.encode('utf-8'), FRAME_TEXT)
 
 
-def send_stop(conn):
+def send_json(conn, data):
     """
-    Send a message asking to stop listening
+    Send a JSON frame.
     Attributes:
     - conn: connection object
+    - data: object to serialize and send
     """
-    time.sleep(TIME_TO_SLEEP) # Small delay to avoid race conditions
-    conn.sendall(json.dumps({
-        'name': "system",
-        'message': "STOP"
-    }).encode('utf-8'))
+    send_frame(conn, json.dumps(data).encode('utf-8'), FRAME_JSON)
+
+
+def recv_exact(conn, size):
+    """
+    Receive exactly size bytes from the connection.
+    The bytes are written in place into a preallocated buffer, so no intermediate
+    byte strings are created or concatenated.
+    Attributes:
+    - conn: connection object
+    - size: number of bytes to receive
+    Outputs:
+    - buffer: bytearray with the received data
+    """
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = conn.recv_into(view[received:], size - received)
+        if count == 0:  # The other side closed the connection
+            raise ConnectionError("La conexión se cerró antes de recibir el mensaje completo")
+        received += count
+    return buffer
+
+
+def recv_frame(conn):
+    """
+    Receive a single framed message.
+    Attributes:
+    - conn: connection object
+    Outputs:
+    - frame_type: type of the received frame
+    - payload: bytes of the received frame
+    """
+    length, frame_type = FRAME_HEADER.unpack(recv_exact(conn, FRAME_HEADER.size))
+    if length > MAX_FRAME_SIZE:  # Do not let a single header make us allocate gigabytes
+        raise ConnectionError(f"Mensaje de {length} bytes, el máximo es {MAX_FRAME_SIZE}")
+    return frame_type, bytes(recv_exact(conn, length))
+
+
+def recv_json(conn):
+    """
+    Receive a JSON frame and decode it.
+    Attributes:
+    - conn: connection object
+    Outputs:
+    - data: decoded object
+    """
+    frame_type, payload = recv_frame(conn)
+    if frame_type != FRAME_JSON:
+        raise json.JSONDecodeError("Se esperaba un mensaje JSON", payload.decode('utf-8', 'replace'), 0)
+    return json.loads(payload)
+
 
 def recv_all(conn):
     """
-    Receive all the data from the client.
+    Receive the payload of the next message.
     Attributes:
     - conn: connection object
     Outputs:
     - data: received data
     """
-    data = b''
-    while True:  # Loop to receive all the data
-        part = conn.recv(1024)
-        data += part  # Append the data
-        if len(part) < 1024:  # If the data is less than 1024 bytes, it means that there is no more data to receive
-            break
-    return data
\ No newline at end of file
+    _, payload = recv_frame(conn)
+    return payload
+
+
+class ProtocolError(Exception):
+    """
+    The peer sent a message that does not fit the turn state machine.
+    """
+
+
+class TurnProtocol:
+    """
+    LISTEN/SPEAK/STOP state machine for one connection.
+    Every message sent carries a sequence number ('seq'), and the receiver checks that
+    none was lost or duplicated. SPEAK acknowledges the LISTEN it answers ('ack'),
+    so the speaker starts as soon as the listener is ready instead of sleeping.
+    Turn of the speaker:  IDLE --LISTEN--> WAITING_SPEAK --SPEAK--> SPEAKING --STOP--> IDLE
+    Turn of the listener: IDLE --LISTEN--> ASKED_TO_LISTEN --SPEAK--> LISTENING --STOP--> IDLE
+    """
+    IDLE = "IDLE"
+    WAITING_SPEAK = "WAITING_SPEAK"  # We sent LISTEN and wait for the peer to be ready
+    SPEAKING = "SPEAKING"  # The peer is listening to us
+    ASKED_TO_LISTEN = "ASKED_TO_LISTEN"  # The peer sent LISTEN and waits for our SPEAK
+    LISTENING = "LISTENING"  # We are listening to the peer
+
+    # (current state, command, sent by us) -> next state
+    TRANSITIONS = {
+        (IDLE, "LISTEN", True): WAITING_SPEAK,
+        (WAITING_SPEAK, "SPEAK", False): SPEAKING,
+        (SPEAKING, "STOP", True): IDLE,
+        (IDLE, "LISTEN", False): ASKED_TO_LISTEN,
+        (ASKED_TO_LISTEN, "SPEAK", True): LISTENING,
+        (LISTENING, "STOP", False): IDLE,
+    }
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.state = self.IDLE
+        self.sent_seq = 0  # Last sequence number sent
+        self.recv_seq = 0  # Last sequence number received
+        self.pending_listen = None  # Sequence number of the LISTEN waiting to be acknowledged
+
+    def _advance(self, command, outgoing):
+        """
+        Move the state machine after sending or receiving a command.
+        Attributes:
+        - command: LISTEN, SPEAK or STOP
+        - outgoing: True if we sent the command, False if we received it
+        """
+        key = (self.state, command, outgoing)
+        if key not in self.TRANSITIONS:
+            raise ProtocolError(f"Comando {command} inesperado en el estado {self.state}")
+        self.state = self.TRANSITIONS[key]
+
+    def send(self, data):
+        """
+        Send a JSON message stamped with the next sequence number.
+        Attributes:
+        - data: dictionary to send
+        Outputs:
+        - seq: sequence number of the message
+        """
+        self.sent_seq += 1
+        send_json(self.conn, dict(data, seq=self.sent_seq))
+        return self.sent_seq
+
+    def recv(self):
+        """
+        Receive the next JSON message, checking its sequence number and
+        advancing the state machine if it is a turn command.
+        Outputs:
+        - data: received message
+        """
+        data = recv_json(self.conn)
+        if data.get('seq') != self.recv_seq + 1:
+            raise ProtocolError(f"Secuencia inesperada: se esperaba {self.recv_seq + 1} y se recibió {data.get('seq')}")
+        self.recv_seq = data['seq']
+
+        if data.get('name') == "system" and data.get('message') in ("LISTEN", "SPEAK", "STOP"):
+            if data['message'] == "SPEAK" and data.get('ack') != self.pending_listen:
+                raise ProtocolError(f"SPEAK no confirma el LISTEN {self.pending_listen}")
+            self._advance(data['message'], outgoing=False)
+            if data['message'] == "LISTEN":
+                self.pending_listen = data['seq']
+        return data
+
+    def send_command(self, command, **extra):
+        """
+        Send a turn command.
+        Attributes:
+        - command: LISTEN, SPEAK or STOP
+        - extra: additional fields for the message
+        """
+        self._advance(command, outgoing=True)
+        seq = self.send(dict(extra, name="system", message=command))
+        if command == "LISTEN":
+            self.pending_listen = seq
+
+    def send_listen(self, last=False):  # Signal other model that we are about to speak and should start listening
+        """
+        Send a message asking to listen
+        Attributes:
+        - last: it is the last turn of the debate, the listener will not answer it
+        """
+        if last:
+            self.send_command("LISTEN", last=True)
+        else:
+            self.send_command("LISTEN")
+
+    def send_speak(self):
+        """
+        Send a message asking to speak, acknowledging the LISTEN we received
+        """
+        self.send_command("SPEAK", ack=self.pending_listen)
+
+    def send_stop(self, text=None):
+        """
+        Send a message asking to stop listening
+        Attributes:
+        - text: text that was spoken, so the listener does not need to transcribe it (optional)
+        """
+        if text is None:
+            self.send_command("STOP")
+        else:
+            self.send_command("STOP", text=text)
+
+    def send_spoken_text(self, text):
+        """
+        Send the final text of our turn while we are still speaking it,
+        so the listener can start preparing its answer before the STOP.
+        Attributes:
+        - text: text being spoken
+        """
+        if self.state != self.SPEAKING:
+            raise ProtocolError(f"Solo se puede enviar el texto durante el turno de habla (estado {self.state})")
+        self.send({'name': "text", 'message': text})
+
+    def expect(self, command, data=None):
+        """
+        Receive a message (or check an already received one) and make sure it is the expected command.
+        Attributes:
+        - command: expected command
+        - data: message already received (optional)
+        Outputs:
+        - data: received message
+        """
+        if data is None:
+            data = self.recv()
+        if data.get('message') != command:
+            raise ProtocolError(f"Se esperaba '{command}' y se recibió {data}")
+        return data
+
+    def close(self):
+        self.conn.close()
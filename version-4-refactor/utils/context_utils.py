@@ -0,0 +1,149 @@
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+def count_tokens(message):
+    """
+    Approximate number of tokens of a message (about 4 characters per token plus the message overhead).
+    Attributes:
+    - message: message with role and content
+    Outputs:
+    - tokens: estimated tokens
+    """
+    return len(message['content']) // 4 + 4
+
+
+class ContextWindow:
+    """
+    Sliding window over the message history.
+    The first messages (system prompt and topic framing) are always sent, followed by
+    the most recent turns that fit in the token budget, so the prompt does not grow
+    with the length of the conversation.
+    """
+    def __init__(self, max_tokens=2000, max_turns=8, head=2):
+        self.max_tokens = max_tokens  # Token budget of the whole prompt
+        self.max_turns = max_turns  # Maximum number of recent messages kept
+        self.head = head  # Messages at the start that are always kept
+
+        self.lock = threading.Lock()  # fit is called from the turn, prefetch and summary workers at once
+        self.calls = 0
+        self.total_saved = 0
+
+    def fit(self, messages):
+        """
+        Select the messages to send.
+        System messages after the head (eg. the summary of the conversation) are always kept too.
+        Attributes:
+        - messages: full message history
+        Outputs:
+        - messages: messages within the budget, in their original order
+        - saved: tokens left out of this call
+        """
+        pinned = messages[:self.head] + [message for message in messages[self.head:] if message['role'] == "system"]
+        budget = self.max_tokens - sum(count_tokens(message) for message in pinned)
+
+        kept = []  # Ids of the recent messages that fit
+        for message in reversed(messages[self.head:]):  # From the most recent one
+            if message['role'] == "system":
+                continue
+            tokens = count_tokens(message)
+            if kept and (len(kept) >= self.max_turns or tokens > budget):  # The last message is always kept
+                break
+            kept.append(id(message))
+            budget -= tokens
+
+        kept = set(kept)
+        window = messages[:self.head] + [message for message in messages[self.head:] if message['role'] == "system" or id(message) in kept]
+        saved = sum(count_tokens(message) for message in messages) - sum(count_tokens(message) for message in window)
+        with self.lock:
+            self.calls += 1
+            self.total_saved += saved
+        return window, saved
+
+    def stats(self):
+        with self.lock:
+            return {
+                'calls': self.calls,
+                'total_saved': self.total_saved,
+            }
+
+
+class ConversationSummarizer:
+    """
+    Rolling summary of the oldest turns of the conversation.
+    While the current speaker talks, a background worker folds the turns that are no longer
+    among the most recent ones into a summary message, starting from the previous summary
+    instead of from scratch. The summary replaces those turns in the history at the next
+    safe point (apply), so the prompt keeps a constant size however long the debate is.
+    """
+    def __init__(self, cm, keep_last=4, head=2):
+        self.cm = cm  # ConversationManager used to generate the summaries
+        self.keep_last = keep_last  # Recent messages never summarized
+        self.head = head  # Messages at the start that are never summarized (personality and topic)
+
+        self.summary_message = None  # Summary message currently in the history
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.lock = threading.Lock()
+        self.pending = None  # Future of the summary being computed
+        self.ready = None  # (summary message, end) computed and waiting to be applied
+
+    def update(self, model, messages):
+        """
+        Start summarizing in the background the turns that left the recent window, if any.
+        Attributes:
+        - model: model that will write the summary
+        - messages: message history
+        """
+        with self.lock:
+            if self.pending is not None or self.ready is not None:  # One summary at a time
+                return
+
+        start = self.head + (1 if self.summary_message is not None else 0)
+        end = len(messages) - self.keep_last
+        turns = [message for message in messages[start:end] if message['role'] != "system"]
+        if not turns:
+            return
+
+        previous = self.summary_message['content'] if self.summary_message is not None else None
+        with self.lock:
+            self.pending = self.executor.submit(self._summarize, model, previous, turns, end)
+
+    def _summarize(self, model, previous, turns, end):
+        """
+        Write the new summary from the previous one and the turns to fold. Runs in the worker.
+        """
+        try:
+            conversation = "\n".join(
+                f"{'Tú' if message['role'] == 'assistant' else 'Otro interlocutor'}: {message['content']}" for message in turns
+            )
+            prompt = (
+                'Resume de forma breve y neutral esta parte de un debate, conservando los argumentos principales '
+                'de cada interlocutor y los cambios de opinión. Responde solo con el resumen.'
+                + (f'\n\nResumen anterior:\n{previous}' if previous else '')
+                + f'\n\nNuevos mensajes:\n{conversation}'
+            )
+            summary = self.cm.generate_response(model, [{"role": "user", "content": prompt}])
+            with self.lock:
+                self.ready = ({"role": "system", "content": f"Resumen de la conversación hasta ahora: {summary}"}, end)
+        except Exception as e:
+            print(f"Error al resumir la conversación: {e}")
+        finally:
+            with self.lock:
+                self.pending = None
+
+    def apply(self, messages):
+        """
+        Swap the summarized turns for the summary in the history, if a new summary is ready.
+        Must be called from the thread that modifies the history.
+        Attributes:
+        - messages: message history (modified in place)
+        """
+        with self.lock:
+            ready, self.ready = self.ready, None
+        if ready is None:
+            return
+        summary_message, end = ready
+        pinned = [message for message in messages[self.head:end] if message['role'] == "system" and message is not self.summary_message]
+        messages[self.head:end] = [summary_message] + pinned  # Other system messages (eg. instructions) are kept
+        self.summary_message = summary_message
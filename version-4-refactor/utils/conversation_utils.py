@@ -1,158 +1,260 @@
-import groq
 import os
-import sys
+import re
 import json
-from dotenv import load_dotenv
-
-from utils.communication_utils import send_listen, send_speak, send_stop, recv_all
-from utils.common_utils import hear, stop_hearing, speak
-
 
-class ConversationManager:
-    def __init__(self, conversation_temperature, frequency_penalty, presence_penalty, api_key=None, change_voice=False):
-        load_dotenv()
-        if api_key is None:
-            self.api_key = os.getenv('API_KEY_1')
-        
-        self.client = groq.Groq(api_key=self.api_key)
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
 
-        self.conversation_temperature = conversation_temperature
-        self.frequency_penalty = frequency_penalty
-        self.presence_penalty = presence_penalty
+from utils.common_utils import hear, stop_hearing, speak, speak_stream, show_listened
+from utils.generation_utils import ResponseGenerator
+from utils.debate_utils import build_first_prompt
+
+
+SENTENCE_END = re.compile(r'[.!?…]+["\')»]*\s+')  # End of a sentence followed by whitespace
+
+
+def split_sentences(tokens):
+    """
+    Group streamed tokens into sentences.
+    Every sentence keeps its trailing whitespace, so joining them gives back the original text.
+    Attributes:
+    - tokens: iterable with the text fragments of a streamed completion
+    Outputs:
+    - sentences: generator with the complete sentences
+    """
+    pending = ""
+    for token in tokens:
+        pending += token
+        start = 0
+        for match in SENTENCE_END.finditer(pending):
+            yield pending[start:match.end()]
+            start = match.end()
+        pending = pending[start:]
+    if pending:
+        yield pending
+
+
+def _announce_sentences(sentences, conn):
+    """
+    Pass the sentences through and send the full text to the listener once the last one is generated.
+    """
+    text = ""
+    for sentence in sentences:
+        text += sentence
+        yield sentence
+    conn.send_spoken_text(text)
+
+
+def _record_sentences(sentences, message):
+    """
+    Pass the sentences through while appending them to the content of a message.
+    """
+    for sentence in sentences:
+        message["content"] += sentence
+        yield sentence
+
+
+class ConversationManager(ResponseGenerator):
+    def __init__(self, conversation_temperature, frequency_penalty, presence_penalty, api_key=None, change_voice=False, stream=False, text_channel=False, pipeline=False, cache=None, scheduler=None, context_window=None, summary_turns=None, personality_mode="replace", backend=None, metrics=None, session=None, hedge_after=None, fallback_model="llama-3.1-8b-instant", audio=True):
+        super().__init__(conversation_temperature, frequency_penalty, presence_penalty, api_key, cache, scheduler, context_window, summary_turns, personality_mode, backend, metrics, session, hedge_after, fallback_model)
+        self.audio = audio  # Without audio nothing is played, recorded or shown, the text channel is required
         self.change_voice = change_voice
+        self.stream = stream  # Speak the responses sentence by sentence while they are generated
+        self.text_channel = text_channel  # Send the spoken text in the STOP message instead of transcribing the audio
+        self.pipeline = pipeline  # Send the text as soon as it is final and generate the answer while the other model speaks
+
+        # Answer being generated in advance while the other model speaks: (input key, future, usage of its request)
+        self.prefetch_executor = ThreadPoolExecutor(max_workers=1) if pipeline else None
+        self.prefetched = None
 
-    def generate_response(self, model,messages):
+    def prefetch_response(self, model, messages):
         """
-        Generate a response from the model given the messages.
+        Start generating the response for the given messages in the background.
         Attributes:
-        - client: Groq client
         - model: model name
-        - messages: list of messages
+        - messages: list of messages the response will be generated for
+        """
+        key = json.dumps([model, messages])
+        usages = []  # Its prompt time is only recorded if it is used for the turn
+        self.prefetched = (key, self.prefetch_executor.submit(self.generate_response, model, list(messages), turn=usages), usages)
+
+    def take_prefetched(self, model, messages):
+        """
+        Get the response generated in advance if it was generated for exactly these messages.
         Outputs:
-        - response: generated response
+        - response: generated response, None if there is none or the messages changed since (eg. personality change)
+        """
+        if self.prefetched is None:
+            return None
+        key, future, usages = self.prefetched
+        self.prefetched = None
+        if key != json.dumps([model, messages]):
+            return None
+        try:
+            response = future.result()  # Waits only for what is left of the generation
+        except Exception as e:  # Generated again by the caller
+            print(f"No se pudo generar la respuesta por adelantado: {e}")
+            return None
+        for usage in usages:
+            self.record_prompt_time(usage)
+        return response
+
+    def prepare_response(self, model, messages):
+        """
+        Generate the response to speak: the full text, or its sentences if streaming is enabled.
         """
-        chat_completion = self.client.chat.completions.create(
-            messages=messages,  # List of messages
-            model=model,  # Model name
-            temperature=self. conversation_temperature,  # Temperature (0 - 2)
-            frequency_penalty=self.frequency_penalty,  # Avoid repeating the same words (0 - 2)
-            presence_penalty=self.presence_penalty,  # Avoid repeating the same arguments (0 - 2)
-        )
-        return chat_completion.choices[0].message.content
+        if self.summarizer is not None:
+            self.summarizer.apply(messages)  # Swap in the summary computed in the background, if ready
+
+        response = self.take_prefetched(model, messages)
+        if response is not None:
+            response = split_sentences([response]) if self.stream else response
+        elif self.stream:
+            response = split_sentences(self.generate_response(model, messages, stream=True, turn=True))
+        else:
+            response = self.generate_response(model, messages, turn=True)
+
+        if self.summarizer is not None:
+            self.summarizer.update(model, messages)  # Summarize the older turns while we speak
+        return response
+
+    def announce_response(self, conn, response):
+        """
+        In pipeline mode, send the final text of the response to the listener as soon as it is known.
+        Must be called once the listener has sent SPEAK.
+        Outputs:
+        - response: response to speak
+        """
+        if not self.pipeline:
+            return response
+        if isinstance(response, str):
+            conn.send_spoken_text(response)
+            return response
+        return _announce_sentences(response, conn)
+
+    def speak_response(self, response):
+        """
+        Speak a response returned by prepare_response.
+        Outputs:
+        - text: spoken text
+        """
+        if not self.audio:
+            return response if isinstance(response, str) else "".join(response)
+        if isinstance(response, str):
+            speak(response, self.change_voice)
+            return response
+        return speak_stream(response, self.change_voice)
 
     def start_conversation(self, model_personality, model, topic, start_message, conn):
         """
         Start the conversation with the client.
         """
-        prompt = f"Context: 'Este es el primer mensaje de la conversación' \
-                    \nTema: {topic}\
-                    \nInstructiones: {start_message}\nTu opinión:"
+        prompt = build_first_prompt(topic, start_message)
         messages = [{"role": "system", "content":model_personality},
                 {"role": "user", "content": prompt}]
-        response = self.generate_response(model, messages)
+        response = self.prepare_response(model, messages)
 
-        send_listen(conn)  # Signal the client to start listening
+        conn.send_listen()  # Signal the client to start listening
 
-        # Receive signal to start speaking
-        data = recv_all(conn).decode('utf-8')  
-        client_msg = json.loads(data)
-        if not client_msg['message'] == "SPEAK":
-            print(f"Error: No se reconoce el comando. Se esperaba 'SPEAK' y se recibió {client_msg['message']}")
-            sys.exit()
+        conn.expect("SPEAK")  # Receive signal to start speaking (acknowledges our LISTEN)
 
-
-        speak(response, self.change_voice)  # Speak the response
+        response = self.speak_response(self.announce_response(conn, response))  # Speak the response
 
         messages.append({"role": "assistant", "content": response})  # Append our response to the message history
 
-        send_stop(conn)  # Signal the client to stop listening
+        conn.send_stop(response if self.text_channel else None)  # Signal the client to stop listening
 
 
         return messages
 
-    def conversation_listen(self, conn):
+    def conversation_listen(self, conn, model=None, messages=None):
         """
         Listen to the conversation with the client.
+        In pipeline mode, if the model and the message history are given, the answer starts being
+        generated as soon as the text of the client is received.
         """
-        # Receive signal to start listening
-        data = recv_all(conn).decode('utf-8')
-        client_msg = json.loads(data)
-        if not client_msg['message'] == "LISTEN":
-            print(f"Error: No se reconoce el comando. Datos recibidos: {data}")
-            sys.exit()
-
-        hear()  # Start listening
+        listen_msg = conn.expect("LISTEN")  # Receive signal to start listening
 
-        send_speak(conn)  # Signal the client to start speaking because we are listening
-
-        # Receive signal to stop listening
-        data = recv_all(conn).decode('utf-8')
-        client_msg = json.loads(data)
-        if not client_msg['message'] == "STOP":
-            print(f"Error: No se reconoce el comando. Datos recibidos: {data}")
-            sys.exit()
-
-        message = stop_hearing()  # Stop listening and process the audio
+        return self.listen_turn(conn, model, messages, listen_msg)
 
+    def listen_turn(self, conn, model=None, messages=None, listen_msg=None):
+        """
+        Listen to the other model once its LISTEN command has been received.
+        With the text channel the spoken text comes in the STOP message, so nothing is recorded or transcribed.
+        In pipeline mode it comes before the STOP, while the audio is still playing.
+        """
+        if listen_msg is not None and listen_msg.get('last'):
+            model = None  # The debate ends after this turn, there is no answer to prefetch
+        record = self.audio and not (self.text_channel or self.pipeline)
+        if record:
+            hear()  # Start listening
+
+        conn.send_speak()  # Signal the client to start speaking because we are listening
+
+        message = None
+        peer_msg = conn.recv()
+        while peer_msg['name'] == "text":  # Final text sent before the STOP
+            message = peer_msg['message']
+            if self.audio:
+                show_listened(message)
+            if self.pipeline and model is not None:
+                if self.summarizer is not None:
+                    self.summarizer.apply(messages)  # Before the prefetch, so it is generated for the final history
+                self.prefetch_response(model, messages + [{"role": "user", "content": message}])
+            peer_msg = conn.recv()
+
+        stop_msg = conn.expect("STOP", peer_msg)  # Receive signal to stop listening
+
+        if record:
+            message = stop_hearing()  # Stop listening and process the audio
+        elif message is None:
+            message = stop_msg.get('text', "")
+            if self.audio:
+                show_listened(message)
 
         return ({"role": "user", "content": message}) 
 
-    def conversation_speak(self, conn, model, messages):
-        response = self.generate_response(model, messages)  # Generate a response
-        messages.append({"role": "assistant", "content": response})  # Append our response to the message history
+    def conversation_speak(self, conn, model, messages, last=False):
+        response = self.prepare_response(model, messages)  # Generate a response
 
-        send_listen(conn)  # Signal the client to start listening
+        conn.send_listen(last)  # Signal the client to start listening (and if it will answer)
 
-        # Receive signal to start speaking
-        data = recv_all(conn).decode('utf-8')
-        client_msg = json.loads(data)
-        if not client_msg['message'] == "SPEAK":
-            print(f"Error: No se reconoce el comando. Datos recibidos: {data}")
-            sys.exit()
+        conn.expect("SPEAK")  # Receive signal to start speaking (acknowledges our LISTEN)
 
-        speak(response, self.change_voice)  # Speak the response
+        response = self.speak_response(self.announce_response(conn, response))  # Speak the response
+        messages.append({"role": "assistant", "content": response})  # Append our response to the message history
 
-        send_stop(conn)  # Signal the client to stop listening
+        conn.send_stop(response if self.text_channel else None)  # Signal the client to stop listening
 
 
 class ConversationManagerClient(ConversationManager):
-    def __init__(self, conversation_temperature, frequency_penalty, presence_penalty, api_key=None, change_voice=True):
+    def __init__(self, conversation_temperature, frequency_penalty, presence_penalty, api_key=None, change_voice=True, stream=False, text_channel=False, pipeline=False, cache=None, scheduler=None, context_window=None, summary_turns=None, personality_mode="replace", backend=None, metrics=None, session=None, hedge_after=None, fallback_model="llama-3.1-8b-instant", audio=True):
+        load_dotenv()
         if api_key is None:
             api_key = os.getenv('API_KEY_2')
-        super().__init__(conversation_temperature, frequency_penalty, presence_penalty, api_key, change_voice)
+        super().__init__(conversation_temperature, frequency_penalty, presence_penalty, api_key, change_voice, stream, text_channel, pipeline, cache, scheduler, context_window, summary_turns, personality_mode, backend, metrics, session, hedge_after, fallback_model, audio)
 
-    def conversation_listen_data(self, conn, msg):
+    def conversation_listen_data(self, conn, msg, model=None, messages=None):
         """
         Listen to the conversation when are you given the data.
         """
-        if not msg['message'] == "LISTEN":
-            print(f"Error: No se reconoce el comando. Datos recibidos: {data}")
-            sys.exit()
-
-        hear()  # Start listening
-
-        send_speak(conn)  # Signal the client to start speaking because we are listening
-
-        # Receive signal to stop listening
-        data = recv_all(conn).decode('utf-8')
-        msg = json.loads(data)
-        if not msg['message'] == "STOP":
-            print(f"Error: No se reconoce el comando. Datos recibidos: {data}")
-            sys.exit()
+        conn.expect("LISTEN", msg)  # The LISTEN command was already received by check_message
 
-        message = stop_hearing()  # Stop listening and process the audio
-
-
-        return ({"role": "user", "content": message}) 
+        return self.listen_turn(conn, model, messages, msg)
 
     def conversation_generate_response(self, conn, model, messages):
         """
         Generate a response from the model given the messages.
         """
-        response = self.generate_response(model, messages)  # Generate a response
-        messages.append({"role": "assistant", "content": response})  # Append our response to the message history
+        response = self.prepare_response(model, messages)  # Generate a response
+        if isinstance(response, str):
+            messages.append({"role": "assistant", "content": response})  # Append our response to the message history
+        else:  # Streamed: the message is completed while it is spoken
+            message = {"role": "assistant", "content": ""}
+            messages.append(message)
+            response = _record_sentences(response, message)
 
-        send_listen(conn)  # Signal the client to start listening
+        conn.send_listen()  # Signal the client to start listening
 
         return response
 
@@ -160,10 +262,8 @@ class ConversationManagerClient(ConversationManager):
         """
         Speak the text to the server.
         """
-        if not msg['message'] == "SPEAK":
-            print(f"Error: No se reconoce el comando. Datos recibidos: {msg}")
-            sys.exit()
+        conn.expect("SPEAK", msg)  # The SPEAK command was already received by check_message
 
-        speak(text, self.change_voice)  # Speak the response
+        text = self.speak_response(self.announce_response(conn, text))  # Speak the response
 
-        send_stop(conn)  # Signal the client to stop listening
+        conn.send_stop(text if self.text_channel else None)  # Signal the client to stop listening
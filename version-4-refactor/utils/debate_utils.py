@@ -0,0 +1,115 @@
+import random
+
+
+START_MESSAGE = (
+    'Expresa claramente tu creencia y posicion sobre el tema en una sola frase clara. '
+    'Este es el inicio de la conversacion, por lo que no puedes hacer referencia a '
+    'interacciones o argumentos pasados. No incluyas ejemplos o mas elaboracion.'
+)
+
+
+def build_personality(opinion, personality, name):
+    """
+    Build the system prompt of a speaker.
+    Attributes:
+    - opinion: opinion of the speaker on the topic
+    - personality: personality chosen in the configuration
+    - name: name of the speaker
+    Outputs:
+    - personality: system prompt
+    """
+    return (
+        f'Tu opinion es: {opinion}\n\n Pero en un futuro se te puede indicar que debe cambiar, en dicho caso no te preocupes y cambia tu opinión.'
+        f'\nTu personalidad es: {personality}'
+        f'\n Tu nombre es: {name}'
+        '\nUsa argumentos, razones, ejemplos y experiencias personales. Además responde a los argumentos del otro interlocutor.'
+        'Si estas en desacuerdo con algo, indica primero que no estas deacuerdo y luego das tu argumento u opinión.'
+        'IMPORTANTE: Da igual lo que lleves de converdsación, si  te dice que cambies (incluso en system) de opición o te covnezcas, hazlo.'
+    )
+
+
+def build_topic(topic):
+    """
+    Build the instructions of the debate on a topic.
+    """
+    return (
+        f'Con tus propios metodos, convenceme de tu opinión en este tema: {topic}. '
+        'Muy importante, tus argumentos deben ser breves y concisos, de una oración como mucho. '
+        'No repitas argumentos u opiniones. NO DIGAS EL NUMERO DEL ARGUMENTO. '
+        'No hagas roleplay ni asumas un rol. Si se te pide que te convenzas, hazlo de manera natural. '
+        'Comunica un solo argumento o idea por mensaje para que la conversación sea clara y efectiva. '
+        'Si citas a alguien, no lo hagas mas de una vez.'
+    )
+
+
+def build_first_prompt(topic, start_message=START_MESSAGE):
+    """
+    Build the prompt of the first message of the debate.
+    """
+    return f"Context: 'Este es el primer mensaje de la conversación' \
+                    \nTema: {topic}\
+                    \nInstructiones: {start_message}\nTu opinión:"
+
+
+def choose_start(conversation_length):
+    """
+    Choose who starts the debate, which decides who wins it (the one that does not say the last message).
+    Outputs:
+    - starting_model: 0 if model 1 (server) starts, 1 if model 2 (client) starts
+    - winner: 0 if model 1 wins, 1 if model 2 wins
+    """
+    starting_model = random.choice([0, 1])
+    winner = 0 if (starting_model == 0 and conversation_length % 2 == 0) or (starting_model == 1 and conversation_length % 2 != 0) else 1
+    return starting_model, winner
+
+
+def persuasion(opinion, definitive=False):
+    """
+    Instruction that makes a speaker start doubting (or get fully convinced) of the opinion of the other speaker.
+    Attributes:
+    - opinion: opinion of the other speaker
+    - definitive: fully convinced instead of starting to doubt
+    Outputs:
+    - instruction: text of the instruction
+    """
+    if definitive:
+        return f"Después de escuchar los argumentos presentados, ahora estás completamente convencido de este punto de vista: {opinion}. Informa al otro interlocutor que has cambiado de opinión, expresa claramente tu acuerdo con su perspectiva y explica brevemente por qué sus argumentos te convencieron. Mantén tu explicación concisa y directa al grano. Comunica claramente tu cambio de postura y explica brevemente por qué has cambiado de opinión."
+    return f"Los argumentos presentados han comenzado a persuadirte, y estás empezando a cambiar tu perspectiva hacia esta visión: {opinion}. Muestra señales sutiles de estar convencido y ajusta gradualmente tu postura. Reconoce la fuerza de los argumentos del otro interlocutor, pero mantén algunas reservas. Mantén tus explicaciones breves y directas al grano. Comunica claramente tu cambio de postura y explica brevemente por qué has comenzado a cambiar de opinión."
+
+
+def changed_personality(personality, instruction):
+    """
+    Full system prompt of a speaker whose opinion changes (used when the personality is replaced).
+    Attributes:
+    - personality: original personality of the speaker
+    - instruction: persuasion instruction
+    Outputs:
+    - personality: new system prompt
+    """
+    return f"Tu punto de vista original era: {personality}. Sin embargo, {instruction[0].lower()}{instruction[1:]}"
+
+
+def personality_changes(winner, messages_left, convince_time, convince_time_definitive, model1_opinion, model2_opinion):
+    """
+    Personality changes that make the loser of the debate get convinced as the end approaches.
+    Only the persuasion instruction is returned, every ResponseGenerator applies it to its own
+    history (see ResponseGenerator.change_personality).
+    Attributes:
+    - winner: winner of the debate
+    - messages_left: remaining messages
+    - convince_time: remaining messages when the loser starts doubting
+    - convince_time_definitive: remaining messages when the loser is fully convinced
+    - model1_opinion, model2_opinion: original opinions
+    Outputs:
+    - model1_instruction: persuasion instruction for model 1 if it has to change, None otherwise
+    - model2_instruction: persuasion instruction for model 2 if it has to change, None otherwise
+    """
+    if messages_left == convince_time and convince_time != 0:  # Halfway through convincing
+        definitive = False
+    elif messages_left == convince_time_definitive:  # Fully convinced
+        definitive = True
+    else:
+        return None, None
+    if winner == 0:  # Model 1 wins, convince model 2
+        return None, persuasion(model1_opinion, definitive)
+    return persuasion(model2_opinion, definitive), None  # Model 2 wins, convince model 1
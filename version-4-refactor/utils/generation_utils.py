@@ -0,0 +1,351 @@
+import os
+import time
+import queue
+import itertools
+import threading
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dotenv import load_dotenv
+
+from utils.scheduler_utils import estimate_tokens, shared_scheduler
+from utils.context_utils import ConversationSummarizer
+from utils.llm_utils import make_backend
+from utils.metrics_utils import shared_metrics
+from utils.debate_utils import changed_personality
+
+
+def _cache_fragments(fragments, cache, key):
+    """
+    Pass the fragments of a streamed response through and cache the full response once it is complete.
+    """
+    response = ""
+    for fragment in fragments:
+        response += fragment
+        yield fragment
+    cache.put(key, response)
+
+
+def _close_stream(future):
+    """
+    Close the streamed response of a hedged request that was not used.
+    """
+    if not future.cancelled() and future.exception() is None:
+        future.result()[1].close()
+
+
+class ResponseGenerator:
+    """
+    Generation of the responses of a model: backend, rate limits, cache, context window, summary,
+    hedging and metrics. Has no audio or network dependencies, so it can run headless.
+    """
+    def __init__(self, conversation_temperature, frequency_penalty, presence_penalty, api_key=None, cache=None, scheduler=None, context_window=None, summary_turns=None, personality_mode="replace", backend=None, metrics=None, session=None, hedge_after=None, fallback_model="llama-3.1-8b-instant"):
+        load_dotenv()
+        if api_key is None:
+            api_key = os.getenv('API_KEY_1')
+        self.api_key = api_key
+
+        # Provider of the completions: Groq unless another backend is given or selected in .env (LLM_BACKEND)
+        self.backend = backend if backend is not None else make_backend(self.api_key)
+        # Rate limits shared by every manager, not applied to backends without provider limits (eg. LocalBackend)
+        self.scheduler = (scheduler if scheduler is not None else shared_scheduler) if getattr(self.backend, "rate_limited", True) else None
+        self.metrics = metrics if metrics is not None else shared_metrics  # Latency and tokens of every call
+        self.session = session if session is not None else f"{os.getpid()}-{id(self):x}"  # Groups the calls of this debate
+
+        self.conversation_temperature = conversation_temperature
+        self.frequency_penalty = frequency_penalty
+        self.presence_penalty = presence_penalty
+
+        self.cache = cache  # ResponseCache shared by the managers that want to reuse responses (optional)
+        self.context_window = context_window  # ContextWindow that limits the history sent to the model (optional)
+        # Fold the turns older than the last summary_turns messages into a summary (optional)
+        self.summarizer = ConversationSummarizer(self, keep_last=summary_turns) if summary_turns is not None else None
+
+        # How personality changes are applied: "replace" overwrites the system prompt, "append" adds
+        # a new system turn and keeps the prompt prefix (and the provider's prefix cache) intact
+        self.personality_mode = personality_mode
+        self.personality_changed = False
+        self.original_personality = None  # First system turn, before any change (replace mode)
+        self.prompt_times = {'before': [], 'after': []}  # (prompt tokens, prompt time) before and after the first change
+
+        # If the model has not answered after hedge_after seconds, ask fallback_model too and keep the first answer (optional)
+        self.hedge_after = hedge_after
+        self.fallback_model = fallback_model
+        self.hedge_executor = ThreadPoolExecutor(max_workers=4) if hedge_after is not None else None
+        self.hedge_lock = threading.Lock()  # Requests can be hedged from the prefetch and summary workers too
+        self.hedges = {'requests': 0, 'hedged': 0, 'fallback_wins': 0}
+
+    def generate_response(self, model,messages, stream=False, turn=False):
+        """
+        Generate a response from the model given the messages.
+        Attributes:
+        - model: model name
+        - messages: list of messages
+        - stream: return the response as it is generated
+        - turn: the response answers a turn of the debate, its prompt time is recorded (see prompt_time_stats).
+          A list collects the usage instead, to record it later (eg. a prefetched answer, once it is used)
+        Outputs:
+        - response: generated response (generator of text fragments if stream is True)
+        """
+        if self.context_window is not None:
+            messages, saved = self.context_window.fit(messages)
+            if saved:
+                print(f"Contexto recortado: {saved} tokens ahorrados")
+
+        if self.cache is not None:
+            key = self.cache.make_key(model, messages, self.conversation_temperature, self.frequency_penalty, self.presence_penalty)
+            response = self.cache.get(key)
+            if response is not None:
+                return iter([response]) if stream else response
+
+        fell_back = False
+        if self.hedge_after is not None and model != self.fallback_model:
+            response, fell_back = self._hedged_request(model, messages, stream, turn)
+        else:
+            response = self._request(model, messages, stream, turn)
+
+        if self.cache is None or fell_back:  # Answers of the fallback model are not cached as answers of the model
+            return response
+        if stream:
+            return _cache_fragments(response, self.cache, key)
+        self.cache.put(key, response)
+        return response
+
+    def _request(self, model, messages, stream=False, turn=False):
+        """
+        Send a request to the backend through the scheduler (if it has rate limits), recording its metrics.
+        Outputs:
+        - response: generated response (generator of text fragments if stream is True)
+        """
+        estimated_tokens = estimate_tokens(messages)
+        start = time.monotonic()
+        request = lambda: self.backend.create(
+            messages=messages,  # List of messages
+            model=model,  # Model name
+            temperature=self. conversation_temperature,  # Temperature (0 - 2)
+            frequency_penalty=self.frequency_penalty,  # Avoid repeating the same words (0 - 2)
+            presence_penalty=self.presence_penalty,  # Avoid repeating the same arguments (0 - 2)
+            stream=stream,
+        )
+        if self.scheduler is not None:
+            chat_completion, queue_wait = self.scheduler.run(self.api_key, request, estimated_tokens)
+        else:
+            chat_completion, queue_wait = request(), 0.0
+        if stream:  # The request is already sent, the fragments are read as they are consumed
+            return self._read_stream(chat_completion, model, start, queue_wait, estimated_tokens, turn)
+
+        usage = getattr(chat_completion, 'usage', None)
+        self.record_call(model, start, queue_wait, usage)
+        if usage is not None:
+            if self.scheduler is not None:  # Correct the estimate with the real consumption
+                self.scheduler.record_usage(self.api_key, estimated_tokens, usage.total_tokens)
+            self.record_turn_usage(usage, turn)
+        return chat_completion.choices[0].message.content
+
+    def _first_answer(self, model, messages, stream, turn=False):
+        """
+        Request a response and wait until it starts: the full response, or the first fragment of a streamed one.
+        Outputs:
+        - answer: response, or (first fragment, rest of the fragments) if stream is True
+        """
+        response = self._request(model, messages, stream, turn)
+        if not stream:
+            return response
+        for fragment in response:
+            if fragment:
+                return fragment, response
+        return "", response
+
+    def _hedged_request(self, model, messages, stream=False, turn=False):
+        """
+        Send a request that falls back to a faster model if it is too slow.
+        When the model has not answered (or started streaming) in hedge_after seconds, the same request is
+        sent to fallback_model and the first one to answer is used. The other one is cancelled: a streamed
+        response is closed, a non streamed one can not be stopped and its answer is discarded.
+        Outputs:
+        - response: generated response (generator of text fragments if stream is True)
+        - fell_back: True if the response comes from the fallback model
+        """
+        primary = self.hedge_executor.submit(self._first_answer, model, messages, stream, turn)
+        done, _ = wait([primary], timeout=self.hedge_after)
+        with self.hedge_lock:
+            self.hedges['requests'] += 1
+            if not done:
+                self.hedges['hedged'] += 1
+
+        winner = primary
+        if not done:
+            print(f"{model} no ha respondido en {self.hedge_after} s, probando también con {self.fallback_model}")
+            fallback = self.hedge_executor.submit(self._first_answer, self.fallback_model, messages, stream)
+            pending = {primary, fallback}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                succeeded = [future for future in done if future.exception() is None]
+                if succeeded:
+                    winner = primary if primary in succeeded else fallback  # The model is preferred on a tie
+                    break
+                winner = done.pop()  # Failed, wait for the other one (its exception is raised if both fail)
+            for future in pending:
+                future.cancel()  # Not started yet (waiting in the executor)
+                if stream:
+                    future.add_done_callback(_close_stream)
+
+        answer = winner.result()
+        fell_back = winner is not primary
+        if fell_back:
+            with self.hedge_lock:
+                self.hedges['fallback_wins'] += 1
+        if not stream:
+            return answer, fell_back
+        first, fragments = answer
+        return itertools.chain([first], fragments), fell_back
+
+    def hedge_stats(self):
+        """
+        How often requests were hedged and how often the fallback model answered first.
+        """
+        with self.hedge_lock:
+            requests = self.hedges['requests']
+            return dict(
+                self.hedges,
+                hedge_rate=self.hedges['hedged'] / requests if requests else 0.0,
+                fallback_rate=self.hedges['fallback_wins'] / requests if requests else 0.0,
+            )
+
+    def _read_stream(self, chat_completion, model, start, queue_wait, estimated_tokens, turn=False):
+        """
+        Text fragments of a streamed completion. The usage comes with the last chunk.
+        The completion is read by a worker thread as soon as it arrives, so its metrics measure the
+        generation and not the time the consumer takes between fragments (eg. speaking every sentence).
+        """
+        fragments = queue.Queue()
+        stop = threading.Event()  # Set when the consumer abandons the stream
+        threading.Thread(target=self._drain_stream, args=(chat_completion, fragments, stop, model, start, queue_wait, estimated_tokens, turn), daemon=True).start()
+        return self._queued_fragments(fragments, stop)
+
+    def _queued_fragments(self, fragments, stop):
+        """
+        Text fragments read by _drain_stream, as they are consumed.
+        """
+        try:
+            while True:
+                fragment = fragments.get()
+                if fragment is None:  # End of the completion
+                    return
+                if isinstance(fragment, Exception):
+                    raise fragment
+                yield fragment
+        finally:
+            stop.set()  # Also when the stream is abandoned (eg. a hedged request that lost)
+
+    def _drain_stream(self, chat_completion, fragments, stop, model, start, queue_wait, estimated_tokens, turn):
+        """
+        Read a streamed completion into a queue (None at the end, the exception if it fails), recording
+        its usage and metrics when the last chunk arrives.
+        """
+        usage = None
+        ttft = None
+        try:
+            for chunk in chat_completion:
+                if stop.is_set():
+                    break
+                x_groq = getattr(chunk, 'x_groq', None)
+                if x_groq is not None and getattr(x_groq, 'usage', None) is not None:
+                    usage = x_groq.usage
+                    if self.scheduler is not None:  # Correct the estimate with the real consumption
+                        self.scheduler.record_usage(self.api_key, estimated_tokens, usage.total_tokens)
+                    self.record_turn_usage(usage, turn)
+                if chunk.choices:
+                    fragment = chunk.choices[0].delta.content or ""
+                    if fragment and ttft is None:
+                        ttft = time.monotonic() - start
+                    fragments.put(fragment)
+            else:
+                self.record_call(model, start, queue_wait, usage, ttft)
+            fragments.put(None)
+        except Exception as e:
+            fragments.put(e)
+        finally:
+            if hasattr(chat_completion, 'close'):
+                chat_completion.close()
+
+    def record_call(self, model, start, queue_wait, usage=None, ttft=None):
+        """
+        Record the latency and tokens of a finished call in the metrics.
+        Attributes:
+        - model: model name
+        - start: time.monotonic() when the call was made
+        - queue_wait: seconds the call waited for the rate limits
+        - usage: usage reported by the provider (optional)
+        - ttft: seconds until the first token, for streamed calls
+        """
+        self.metrics.record(
+            self.session, model, time.monotonic() - start, queue_wait, ttft,
+            getattr(usage, 'prompt_tokens', None), getattr(usage, 'completion_tokens', None), stream=ttft is not None,
+        )
+
+    def record_turn_usage(self, usage, turn):
+        """
+        Record the prompt time of a request if it answers a turn (see generate_response).
+        Summaries, names and the fallback model of hedged requests have prompts of another shape
+        and would skew the comparison before and after the personality change.
+        """
+        if turn is True:
+            self.record_prompt_time(usage)
+        elif isinstance(turn, list):  # Collected to be recorded later
+            turn.append(usage)
+
+    def record_prompt_time(self, usage):
+        """
+        Record the time the provider took to process the prompt of a turn.
+        """
+        if getattr(usage, 'prompt_time', None) is not None:
+            phase = 'after' if self.personality_changed else 'before'
+            self.prompt_times[phase].append((usage.prompt_tokens, usage.prompt_time))
+
+    def prompt_time_stats(self):
+        """
+        Average prompt processing time before and after the first personality change.
+        """
+        stats = {}
+        for phase, records in self.prompt_times.items():
+            tokens = sum(record[0] for record in records)
+            seconds = sum(record[1] for record in records)
+            stats[phase] = {
+                'requests': len(records),
+                'avg_prompt_time': seconds / len(records) if records else 0.0,
+                'ms_per_1k_tokens': seconds * 1000 / tokens * 1000 if tokens else 0.0,
+            }
+        return stats
+
+    def change_personality(self, messages, instruction):
+        """
+        Apply a personality change to the message history.
+        In append mode only the instruction is added, as a new system turn. Otherwise the first
+        system turn is replaced by the original personality followed by the instruction.
+        Attributes:
+        - messages: message history (modified in place)
+        - instruction: persuasion instruction (see debate_utils.personality_changes)
+        """
+        if self.personality_mode == "append":
+            messages.append({"role": "system", "content": instruction})
+        else:
+            if self.original_personality is None:
+                self.original_personality = messages[0]["content"]
+            messages[0] = {"role": "system", "content": changed_personality(self.original_personality, instruction)}
+        self.personality_changed = True
+
+    def respond(self, model, messages):
+        """
+        Generate the next response of a text only conversation, keeping the rolling summary up to date.
+        Attributes:
+        - model: model name
+        - messages: message history (the summary is swapped in place)
+        Outputs:
+        - response: generated response
+        """
+        if self.summarizer is not None:
+            self.summarizer.apply(messages)
+        response = self.generate_response(model, messages, turn=True)
+        if self.summarizer is not None:
+            self.summarizer.update(model, messages)
+        return response
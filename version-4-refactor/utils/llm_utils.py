@@ -0,0 +1,208 @@
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+
+from types import SimpleNamespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils.context_utils import count_tokens
+
+
+# Words used by the local stand-in to build its (meaningless but deterministic) responses
+LOCAL_VOCABULARY = (
+    "creo que la tortilla de patatas es mejor con sin ketchup porque el sabor textura huevo cebolla "
+    "tradición receta familia siempre nunca argumento razón ejemplo experiencia opinión estudio dice "
+    "verdad mentira claro evidente importante personas muchos pocos casa restaurante cocina"
+).split()
+
+
+class GroqBackend:
+    """
+    Completions from the Groq API (or any server compatible with it, through base_url).
+    """
+    rate_limited = True  # Requests go through the RequestScheduler
+
+    def __init__(self, api_key=None, base_url=None):
+        import groq  # Only needed by this backend
+
+        self.client = groq.Groq(api_key=api_key, base_url=base_url, max_retries=0)  # Retries are handled by the scheduler
+
+    def create(self, **request):
+        """
+        Create a chat completion. Same arguments and result as groq's chat.completions.create.
+        """
+        return self.client.chat.completions.create(**request)
+
+
+class LocalBackend:
+    """
+    Offline deterministic stand-in for the LLM provider.
+    The same request with the same seed always gets the same response, produced at a configurable
+    latency (time to first token) and speed (tokens per second). Results have the same shape as
+    the ones of groq, so everything above generate_response works unchanged.
+    """
+    rate_limited = False  # No provider limits, requests are not scheduled
+
+    def __init__(self, seed=0, latency=0.3, tokens_per_second=250.0, min_words=8, max_words=30):
+        self.seed = seed
+        self.latency = latency  # Seconds until the first token
+        self.tokens_per_second = tokens_per_second
+        self.min_words = min_words
+        self.max_words = max_words
+
+    def generate(self, messages, model, temperature=1, frequency_penalty=0, presence_penalty=0):
+        """
+        Build the response of a request.
+        Outputs:
+        - tokens: list of text fragments of the response
+        - usage: dictionary with the token counts
+        """
+        request = json.dumps([model, messages, temperature, frequency_penalty, presence_penalty], ensure_ascii=False, sort_keys=True)
+        rng = random.Random(f"{self.seed}:{hashlib.sha256(request.encode('utf-8')).hexdigest()}")
+
+        tokens = []
+        for i in range(rng.randint(self.min_words, self.max_words)):
+            word = rng.choice(LOCAL_VOCABULARY)
+            if i == 0 or tokens[-1].endswith(". "):
+                word = word.capitalize()
+            tokens.append(word + (". " if rng.random() < 0.12 else " "))
+        tokens[-1] = tokens[-1].rstrip(". ") + "."
+
+        prompt_tokens = sum(count_tokens(message) for message in messages)
+        usage = {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': len(tokens),
+            'total_tokens': prompt_tokens + len(tokens),
+            'prompt_time': self.latency,
+            'completion_time': len(tokens) / self.tokens_per_second,
+            'total_time': self.latency + len(tokens) / self.tokens_per_second,
+        }
+        return tokens, usage
+
+    def stream_tokens(self, tokens):
+        """
+        Yield the tokens at the configured latency and speed.
+        """
+        time.sleep(self.latency)
+        for token in tokens:
+            yield token
+            time.sleep(1 / self.tokens_per_second)
+
+    def create(self, messages, model, temperature=1, frequency_penalty=0, presence_penalty=0, stream=False):
+        """
+        Create a chat completion. Same arguments and result shape as groq's chat.completions.create.
+        """
+        tokens, usage = self.generate(messages, model, temperature, frequency_penalty, presence_penalty)
+        if stream:
+            return self._chunks(tokens, usage)
+
+        time.sleep(usage['total_time'])
+        return SimpleNamespace(
+            model=model,
+            choices=[SimpleNamespace(message=SimpleNamespace(role="assistant", content="".join(tokens)), finish_reason="stop")],
+            usage=SimpleNamespace(**usage),
+        )
+
+    def _chunks(self, tokens, usage):
+        for token in self.stream_tokens(tokens):
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=token), finish_reason=None)], x_groq=None)
+        yield SimpleNamespace(  # Last chunk, with the usage like groq does
+            choices=[SimpleNamespace(delta=SimpleNamespace(content=None), finish_reason="stop")],
+            x_groq=SimpleNamespace(usage=SimpleNamespace(**usage)),
+        )
+
+
+def make_backend(api_key=None):
+    """
+    Create the backend selected in the environment (.env):
+    - LLM_BACKEND=groq (default): Groq API, or the server at LLM_BASE_URL if given
+    - LLM_BACKEND=local: LocalBackend configured with LLM_LOCAL_SEED, LLM_LOCAL_LATENCY and LLM_LOCAL_TPS
+    """
+    if os.getenv('LLM_BACKEND', 'groq') == 'local':
+        return LocalBackend(
+            seed=int(os.getenv('LLM_LOCAL_SEED', '0')),
+            latency=float(os.getenv('LLM_LOCAL_LATENCY', '0.3')),
+            tokens_per_second=float(os.getenv('LLM_LOCAL_TPS', '250')),
+        )
+    return GroqBackend(api_key, os.getenv('LLM_BASE_URL'))
+
+
+class LocalCompletionsHandler(BaseHTTPRequestHandler):
+    """
+    OpenAI compatible /chat/completions endpoint served by a LocalBackend
+    (the backend is set on the server as server.backend).
+    """
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self.send_error(404)
+            return
+
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        backend = self.server.backend
+        model = request.get('model', 'local')
+        tokens, usage = backend.generate(
+            request['messages'], model, request.get('temperature', 1),
+            request.get('frequency_penalty', 0), request.get('presence_penalty', 0),
+        )
+        completion_id = f"local-{hashlib.sha256(''.join(tokens).encode('utf-8')).hexdigest()[:12]}"
+
+        if not request.get('stream'):
+            time.sleep(usage['total_time'])
+            self._send_json({
+                'id': completion_id,
+                'object': "chat.completion",
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{'index': 0, 'message': {'role': "assistant", 'content': "".join(tokens)}, 'finish_reason': "stop"}],
+                'usage': usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+        chunk = {'id': completion_id, 'object': "chat.completion.chunk", 'created': int(time.time()), 'model': model}
+        for token in backend.stream_tokens(tokens):
+            self._send_event(dict(chunk, choices=[{'index': 0, 'delta': {'content': token}, 'finish_reason': None}]))
+        self._send_event(dict(chunk, choices=[{'index': 0, 'delta': {}, 'finish_reason': "stop"}], x_groq={'usage': usage}))
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def _send_json(self, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_event(self, data):
+        self.wfile.write(f"data: {json.dumps(data)}\n\n".encode('utf-8'))
+        self.wfile.flush()
+
+    def log_message(self, format, *args):  # Silence the log of every request
+        pass
+
+
+def serve_local_backend(backend, host='localhost', port=8000):
+    """
+    Serve a LocalBackend through an OpenAI compatible HTTP endpoint.
+    Point the debates to it with LLM_BASE_URL=http://host:port
+    """
+    server = ThreadingHTTPServer((host, port), LocalCompletionsHandler)
+    server.backend = backend
+    print(f"Backend local escuchando en http://{host}:{port}...")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    # python -m utils.llm_utils [port] [seed] [latency] [tokens per second]
+    args = sys.argv[1:]
+    port = int(args[0]) if len(args) > 0 else 8000
+    serve_local_backend(LocalBackend(
+        seed=int(args[1]) if len(args) > 1 else 0,
+        latency=float(args[2]) if len(args) > 2 else 0.3,
+        tokens_per_second=float(args[3]) if len(args) > 3 else 250.0,
+    ), port=port)
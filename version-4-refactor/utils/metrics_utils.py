@@ -0,0 +1,100 @@
+import json
+import time
+import threading
+
+from collections import deque
+
+
+METRIC_FIELDS = ('wall_time', 'ttft', 'queue_wait', 'prompt_tokens', 'completion_tokens')  # Fields aggregated into percentiles
+
+
+def percentile(values, p):
+    """
+    Nearest-rank percentile.
+    Attributes:
+    - values: sorted list of numbers
+    - p: percentile (0 - 100)
+    Outputs:
+    - value: value of the percentile, None if there are no values
+    """
+    if not values:
+        return None
+    rank = max(1, -(-len(values) * p // 100))  # ceil(n * p / 100)
+    return values[int(rank) - 1]
+
+
+class CallMetrics:
+    """
+    Record of every request made to the LLM provider: model, tokens, wall time, time to first
+    token (streamed requests) and time waiting for the rate limits. Records are kept in memory
+    to aggregate them per session or per model, and optionally appended to a JSON lines log.
+    """
+    def __init__(self, log_file=None, max_records=10000):
+        self.log_file = log_file  # Structured log, one JSON object per call (optional)
+        self.records = deque(maxlen=max_records)  # Oldest records are dropped first
+        self.lock = threading.Lock()  # Shared by every manager of the process
+
+    def record(self, session, model, wall_time, queue_wait, ttft=None, prompt_tokens=None, completion_tokens=None, stream=False):
+        """
+        Record a finished call.
+        Attributes:
+        - session: identifier of the debate the call belongs to
+        - model: model name
+        - wall_time: seconds from the request to the last token, including the queue wait
+        - queue_wait: seconds waiting for the rate limits
+        - ttft: seconds until the first token (only streamed calls)
+        - prompt_tokens, completion_tokens: tokens reported by the provider, if any
+        - stream: if the response was streamed
+        """
+        record = {
+            'time': time.time(),
+            'session': session,
+            'model': model,
+            'stream': stream,
+            'wall_time': wall_time,
+            'ttft': ttft,
+            'queue_wait': queue_wait,
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+        }
+        with self.lock:
+            self.records.append(record)
+            if self.log_file is not None:
+                with open(self.log_file, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(record) + "\n")
+
+    def summary(self, by='model', session=None):
+        """
+        Aggregate the records into percentiles.
+        Attributes:
+        - by: record field to group by ('model' or 'session')
+        - session: only take into account the calls of this session (optional)
+        Outputs:
+        - summary: dictionary with the number of calls and the p50, p90, p99, max and total of every field per group
+        """
+        with self.lock:
+            records = [record for record in self.records if session is None or record['session'] == session]
+
+        groups = {}
+        for record in records:
+            groups.setdefault(record[by], []).append(record)
+
+        summary = {}
+        for group, group_records in groups.items():
+            summary[group] = {'calls': len(group_records)}
+            for field in METRIC_FIELDS:
+                values = sorted(record[field] for record in group_records if record[field] is not None)
+                summary[group][field] = {
+                    'p50': percentile(values, 50),
+                    'p90': percentile(values, 90),
+                    'p99': percentile(values, 99),
+                    'max': values[-1] if values else None,
+                    'total': sum(values),
+                }
+            tokens = sum(record['completion_tokens'] or 0 for record in group_records)
+            seconds = sum(record['wall_time'] - record['queue_wait'] for record in group_records if record['completion_tokens'])
+            summary[group]['tokens_per_second'] = tokens / seconds if seconds else None
+        return summary
+
+
+shared_metrics = CallMetrics()  # Used by every ConversationManager of the process unless told otherwise
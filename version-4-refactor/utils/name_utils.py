@@ -0,0 +1,83 @@
+import os
+import re
+import json
+import random
+import threading
+
+
+DEFAULT_NAMES = ["Lucía", "Mateo", "Carmen", "Javier"]  # Used only if the model does not give enough valid names
+ENUMERATOR = re.compile(r'^\s*(?:\d+\s*[.)\-:]|[-*•·]|[a-zA-Z][.)])\s*')  # "1.", "2)", "-", "*", "a)" before a list item
+
+
+def parse_names(text):
+    """
+    Extract the names of a model response, whatever the list format: separated by commas or
+    one per line, numbered or with bullets, after a preamble ("Aquí tienes los nombres: ...").
+    Items that are not a single word are discarded.
+    Attributes:
+    - text: response of the model
+    Outputs:
+    - names: list of names, in order
+    """
+    names = []
+    for item in re.split(r'[,;\n]', text):
+        item = item.rsplit(':', 1)[-1]  # Drop a preamble before the first name
+        item = ENUMERATOR.sub('', item).strip(' \t"\'«».*')
+        words = item.split()
+        if len(words) == 1 and words[0].isalpha():
+            names.append(words[0])
+    return names
+
+
+class NameService:
+    """
+    Names for the speakers of the debates.
+    Names generated by the models are kept in a local pool (saved to disk), so most debates
+    get their names without calling the model. When the pool is too small it is refilled
+    with a single request that asks for a whole batch of names.
+    """
+    def __init__(self, pool_file="names-pool.json", batch_size=20):
+        self.pool_file = pool_file
+        self.batch_size = batch_size
+        self.lock = threading.Lock()  # Shared by every debate of the process
+        self.pool = []
+        if os.path.exists(pool_file):
+            with open(pool_file, 'r', encoding='utf-8') as f:
+                self.pool = json.load(f)
+
+    def get_names(self, cm, model, count=2):
+        """
+        Get distinct names for the speakers.
+        Attributes:
+        - cm: ConversationManager used if the pool has to be refilled
+        - model: model that will generate the names
+        - count: number of names
+        Outputs:
+        - names: list of distinct names
+        """
+        with self.lock:
+            if len(self.pool) < count:
+                self.refill(cm, model)
+            if len(self.pool) < count:  # The model did not give enough valid names
+                self.pool.extend(name for name in DEFAULT_NAMES if name not in self.pool)
+            return random.sample(self.pool, count)
+
+    def refill(self, cm, model):
+        """
+        Ask the model for a batch of names in a single request and add them to the pool.
+        """
+        prompt = (
+            f'Dame {self.batch_size} nombres de persona en español distintos, de UNA SOLA PALABRA cada uno, separados por comas. '
+            'No simules una respuesta, solo necesito los nombres. Los nombres no pueden ser números ni digitos.'
+        )
+        message = [{"role": "user", "content": prompt}]
+        response = cm.generate_response(model, message)
+
+        for name in parse_names(response):
+            if name not in self.pool:
+                self.pool.append(name)
+
+        tmp_file = f"{self.pool_file}.{os.getpid()}.tmp"  # Other processes (eg. batch workers) may be saving it too
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(self.pool, f, indent=4, ensure_ascii=False)
+        os.replace(tmp_file, self.pool_file)
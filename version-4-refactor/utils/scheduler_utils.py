@@ -0,0 +1,187 @@
+import os
+import time
+import random
+import threading
+
+from utils.context_utils import count_tokens
+
+
+def estimate_tokens(messages, completion_tokens=256):
+    """
+    Rough estimate of the tokens a request will consume (about 4 characters per token).
+    Attributes:
+    - messages: list of messages of the request
+    - completion_tokens: tokens reserved for the response
+    Outputs:
+    - tokens: estimated tokens
+    """
+    return sum(count_tokens(message) for message in messages) + completion_tokens
+
+
+def is_retryable(error):
+    """
+    Check if a failed request is worth retrying: rate limits (429), server errors and connection problems.
+    """
+    status = getattr(error, 'status_code', None)
+    if status is not None:
+        return status == 429 or status >= 500
+    name = type(error).__name__
+    return isinstance(error, (ConnectionError, TimeoutError)) or "Connection" in name or "Timeout" in name
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously up to its capacity.
+    Reservations may leave it below zero: the deficit is the time the caller has to wait,
+    so concurrent callers queue up in the order they reserved.
+    """
+    def __init__(self, capacity, per_minute):
+        self.capacity = capacity
+        self.rate = per_minute / 60.0  # Tokens per second
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, amount, now):
+        """
+        Take tokens from the bucket.
+        Outputs:
+        - wait: seconds to wait until the reserved tokens are really available
+        """
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        self.level -= min(amount, self.capacity)  # A single request can never wait for more than a full bucket
+        return max(0.0, -self.level / self.rate)
+
+    def refund(self, amount):
+        """
+        Give back (or take, if negative) tokens after knowing the real consumption.
+        """
+        self.level = min(self.capacity, self.level + amount)
+
+
+class RequestScheduler:
+    """
+    Scheduler shared by every request to the LLM provider.
+    Keeps a request bucket and a token bucket per API key so requests wait for their turn
+    instead of being rejected, and retries rate limited or failed requests with jittered backoff.
+    Limits not given are read from the environment (.env) when the first request is scheduled:
+    LLM_REQUESTS_PER_MINUTE and LLM_TOKENS_PER_MINUTE (Groq free tier by default).
+    """
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, max_retries=5, base_backoff=1.0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.share = 1.0  # Fraction of the limits this process may use (eg. one of several worker processes)
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.lock = threading.Lock()
+        self.keys = {}  # State of every API key
+
+    def limits(self):
+        """
+        Limits of every API key in this process.
+        Outputs:
+        - requests_per_minute, tokens_per_minute
+        """
+        requests_per_minute = self.requests_per_minute if self.requests_per_minute is not None else float(os.getenv('LLM_REQUESTS_PER_MINUTE', '30'))
+        tokens_per_minute = self.tokens_per_minute if self.tokens_per_minute is not None else float(os.getenv('LLM_TOKENS_PER_MINUTE', '6000'))
+        return requests_per_minute * self.share, tokens_per_minute * self.share
+
+    def _state(self, api_key):
+        if api_key not in self.keys:
+            requests_per_minute, tokens_per_minute = self.limits()
+            self.keys[api_key] = {
+                'requests': TokenBucket(requests_per_minute, requests_per_minute),
+                'tokens': TokenBucket(tokens_per_minute, tokens_per_minute),
+                'queued': 0,  # Requests waiting for their turn right now
+                'calls': 0,
+                'retries': 0,
+                'rate_limited': 0,
+                'wait_total': 0.0,
+                'wait_max': 0.0,
+            }
+        return self.keys[api_key]
+
+    def run(self, api_key, request, estimated_tokens):
+        """
+        Run a request when the limits of its API key allow it, retrying it if needed.
+        Attributes:
+        - api_key: API key the request is made with
+        - request: function that makes the request
+        - estimated_tokens: tokens the request is expected to consume
+        Outputs:
+        - result: result of the request
+        - waited: seconds the request waited for the rate limits (all attempts)
+        """
+        waited = 0.0
+        for attempt in range(self.max_retries + 1):
+            with self.lock:
+                state = self._state(api_key)
+                now = time.monotonic()
+                wait = max(state['requests'].reserve(1, now), state['tokens'].reserve(estimated_tokens, now))
+                state['queued'] += 1
+
+            if wait > 0:
+                time.sleep(wait)
+            waited += wait
+
+            with self.lock:
+                state['queued'] -= 1
+                state['calls'] += 1
+                state['wait_total'] += wait
+                state['wait_max'] = max(state['wait_max'], wait)
+
+            try:
+                return request(), waited
+            except Exception as e:
+                if not is_retryable(e) or attempt == self.max_retries:
+                    raise
+                delay = self._retry_delay(e, attempt)
+                with self.lock:
+                    state['retries'] += 1
+                    if getattr(e, 'status_code', None) == 429:
+                        state['rate_limited'] += 1
+                print(f"Petición fallida ({e}), reintentando en {delay:.1f} s")
+                time.sleep(delay)
+
+    def _retry_delay(self, error, attempt):
+        """
+        Seconds to wait before retrying: the Retry-After of the provider if present, exponential backoff otherwise.
+        Both are jittered so queued requests do not retry all at once, the Retry-After only upwards (retrying
+        before it just gets another 429).
+        """
+        delay = self.base_backoff * 2 ** attempt
+        response = getattr(error, 'response', None)
+        retry_after = response.headers.get('retry-after') if response is not None else None
+        if retry_after is not None:
+            try:
+                return float(retry_after) + random.uniform(0, self.base_backoff)
+            except ValueError:
+                pass
+        return delay * random.uniform(0.5, 1.5)
+
+    def record_usage(self, api_key, estimated_tokens, used_tokens):
+        """
+        Correct the token bucket of an API key with the real consumption of a request.
+        """
+        with self.lock:
+            self._state(api_key)['tokens'].refund(estimated_tokens - used_tokens)
+
+    def stats(self):
+        """
+        Queue depth, waits and retries of every API key (identified by its last characters).
+        """
+        with self.lock:
+            return {
+                f"...{api_key[-4:]}" if api_key else "sin clave": {
+                    'queued': state['queued'],
+                    'calls': state['calls'],
+                    'retries': state['retries'],
+                    'rate_limited': state['rate_limited'],
+                    'wait_avg': state['wait_total'] / state['calls'] if state['calls'] else 0.0,
+                    'wait_max': state['wait_max'],
+                }
+                for api_key, state in self.keys.items()
+            }
+
+
+shared_scheduler = RequestScheduler()  # Used by every ConversationManager of the process unless told otherwise